@@ -0,0 +1,146 @@
+import copy
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from app import constants
+
+
+class TokenCache:
+    """Ограниченный LRU-кеш пользователей по ключу токена.
+
+    Живёт в памяти процесса; записи устаревают через
+    ``TOKEN_CACHE_TIMEOUT`` секунд, самые давние вытесняются при
+    превышении ``TOKEN_CACHE_SIZE``.
+    """
+
+    def __init__(self, maxsize, timeout):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        with self.lock:
+            self.entries[key] = (time.monotonic() + timeout, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+token_cache = TokenCache(
+    constants.TOKEN_CACHE_SIZE, constants.TOKEN_CACHE_TIMEOUT,
+)
+
+
+def get_generation_key(key):
+    """Ключ поколения токена в общем кеше; сам токен в нём не хранится."""
+    return f"auth-generation:{hashlib.sha256(key.encode()).hexdigest()}"
+
+
+def get_generation(key):
+    """Текущее поколение токена, при отсутствии заводит новое."""
+    generation_key = get_generation_key(key)
+    generation = cache.get(generation_key)
+    if generation is None:
+        cache.add(generation_key, uuid.uuid4().hex, None)
+        generation = cache.get(generation_key)
+    return generation
+
+
+def invalidate_tokens(*keys):
+    """Делает закешированные токены недействительными во всех процессах.
+
+    Записи процессов сверяются с поколением в общем кеше, поэтому
+    достаточно сменить поколение. Вызывается после фиксации транзакции,
+    иначе другой процесс успел бы прочитать из базы старые данные уже
+    с новым поколением. Без общего кеша токены убираются только из кеша
+    этого процесса.
+    """
+    token_cache.delete(*keys)
+    if settings.TOKEN_CACHE_SHARED:
+        cache.set_many(
+            {get_generation_key(key): uuid.uuid4().hex for key in keys},
+            None,
+        )
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Токенная аутентификация без запроса к базе при повторных запросах.
+
+    Запись в кеше процесса хранит значения полей пользователя на момент
+    чтения из базы. Если включён ``TOKEN_CACHE_SHARED``, то есть кеш
+    Django общий для всех процессов, запись хранит и поколение токена и
+    живёт ``TOKEN_CACHE_TIMEOUT`` секунд, пока поколение в общем кеше не
+    сменилось. Без общего кеша запись живёт ``TOKEN_CACHE_LOCAL_TIMEOUT``
+    секунд без проверок: столько другие процессы ещё принимают
+    отозванный токен и видят старые пароль, блокировку и профиль.
+    Каждый запрос получает нового пользователя, который при сохранении
+    пишет только изменённые поля.
+    """
+
+    def authenticate_credentials(self, key):
+        shared = settings.TOKEN_CACHE_SHARED
+        entry = token_cache.get(key)
+        if entry is not None and (
+            not shared
+            or cache.get(get_generation_key(key)) == entry["generation"]
+        ):
+            return self.build_credentials(key, entry)
+
+        # Поколение читается до базы: смена данных после чтения
+        # сменит и поколение, и запись не будет принята
+        generation = get_generation(key) if shared else None
+        user, token = super().authenticate_credentials(key)
+        entry = {
+            "generation": generation,
+            "values": user.get_field_values(),
+            "created": token.created,
+        }
+        token_cache.set(
+            key,
+            entry,
+            None if shared else constants.TOKEN_CACHE_LOCAL_TIMEOUT,
+        )
+        return self.build_credentials(key, entry)
+
+    def build_credentials(self, key, entry):
+        values = copy.deepcopy(entry["values"])
+        User = get_user_model()
+        user = User.from_db(
+            User.objects.db, list(values), list(values.values()),
+        )
+        user.track_changes()
+        token = Token(key=key, user=user, created=entry["created"])
+        return user, token
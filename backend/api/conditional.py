@@ -0,0 +1,68 @@
+import hashlib
+
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
+
+from recipe.models import TableVersion
+
+
+class ConditionalGetMixin:
+    """Условные GET-запросы для list и retrieve.
+
+    ETag и Last-Modified строятся по версиям таблиц из ``versioned_models``
+    и, если ``user_dependent``, по версии избранного, корзины и подписок
+    пользователя. Ответ 304 отдаётся до выборки и сериализации данных.
+    """
+
+    versioned_models = ()
+    user_dependent = False
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super().list, request, *args, **kwargs,
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super().retrieve, request, *args, **kwargs,
+        )
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        etag, last_modified = self.get_validators(request)
+        response = condition(
+            etag_func=lambda *args, **kwargs: etag,
+            last_modified_func=lambda *args, **kwargs: last_modified,
+        )(handler)(request, *args, **kwargs)
+        patch_cache_control(response, no_cache=True)
+        if self.user_dependent:
+            patch_cache_control(response, private=True)
+            patch_vary_headers(response, ["Authorization"])
+        return response
+
+    def get_table_state(self, request):
+        """Версии таблиц и пользователя, загруженные одним запросом.
+
+        Возвращает словарь версий по именам и дату последнего изменения.
+        """
+        if not hasattr(self, "_table_state"):
+            names = [
+                model._meta.label_lower for model in self.versioned_models
+            ]
+            if self.user_dependent and request.user.is_authenticated:
+                names.append(TableVersion.user_state(request.user.pk))
+            versions, last_modified = TableVersion.get_state(*names)
+            self._table_state = dict(zip(names, versions)), last_modified
+        return self._table_state
+
+    def get_validators(self, request):
+        """Возвращает ETag и дату последнего изменения ответа."""
+        versions, last_modified = self.get_table_state(request)
+        user_id = None
+        if self.user_dependent and request.user.is_authenticated:
+            user_id = request.user.pk
+
+        params = sorted(request.query_params.lists())
+        digest = hashlib.md5(
+            repr((request.path, params, user_id, versions)).encode(),
+        ).hexdigest()
+        return digest, last_modified
@@ -1,6 +1,21 @@
+import re
+
 import django_filters
-from django.db.models import Case, IntegerField, Value, When
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import (
+    Case,
+    Exists,
+    F,
+    IntegerField,
+    OuterRef,
+    Q,
+    Value,
+    When,
+)
+from rest_framework.filters import BaseFilterBackend, OrderingFilter
 
+from app import constants
 from recipe.models import Cart, Favorite, Ingredient, Recipe
 
 
@@ -49,7 +64,13 @@ class RecipeFilter(django_filters.FilterSet):
             if not tags_list:
                 tags_list = [value]
 
-        return queryset.filter(tags__slug__in=tags_list).distinct()
+        return queryset.filter(
+            Exists(
+                Recipe.tags.through.objects.filter(
+                    recipe_id=OuterRef("pk"), tag__slug__in=tags_list,
+                ),
+            ),
+        )
 
     def filter_favorited(self, queryset, name, value):
         """Фильтрация избранных рецептов."""
@@ -72,3 +93,51 @@ class RecipeFilter(django_filters.FilterSet):
                 ),
             )
         return queryset
+
+
+class RecipeSearchFilter(BaseFilterBackend):
+    """Полнотекстовый поиск рецептов по параметру ?search=.
+
+    На PostgreSQL используется поисковый вектор с GIN-индексом и
+    ранжирование SearchRank, на остальных базах - поиск подстрок слов
+    запроса с рангом по совпадению в названии. Без явного ?ordering=
+    результаты сортируются по релевантности. Бэкенд должен стоять после
+    OrderingFilter.
+    """
+
+    search_param = "search"
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, "").strip()
+        if not query:
+            return queryset
+
+        if connections[queryset.db].vendor == "postgresql":
+            search_query = SearchQuery(
+                query, config=constants.SEARCH_CONFIG, search_type="websearch",
+            )
+            queryset = queryset.filter(search_vector=search_query).annotate(
+                rank=SearchRank(F("search_vector"), search_query),
+            )
+        else:
+            # iregex, в отличие от icontains, на SQLite не зависит от
+            # регистра и для кириллицы
+            terms = [re.escape(term) for term in query.split()]
+            for term in terms:
+                queryset = queryset.filter(
+                    Q(name__iregex=term) | Q(text__iregex=term),
+                )
+            queryset = queryset.annotate(
+                rank=sum(
+                    Case(
+                        When(name__iregex=term, then=Value(2)),
+                        default=Value(1),
+                        output_field=IntegerField(),
+                    )
+                    for term in terms
+                ),
+            )
+
+        if OrderingFilter.ordering_param in request.query_params:
+            return queryset
+        return queryset.order_by("-rank", *queryset.query.order_by)
@@ -0,0 +1,80 @@
+import io
+import posixpath
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, features
+
+from app import constants
+from recipe.storage import is_content_addressed
+
+# Форматы копий: JPEG читается везде, WebP и AVIF - если их умеет Pillow
+FORMATS = ("jpeg", "webp", "avif")
+
+
+def get_formats():
+    return [
+        format for format in FORMATS
+        if format == "jpeg" or features.check(format)
+    ]
+
+
+def get_variant_name(name, width, format):
+    directory, filename = posixpath.split(name)
+    stem = posixpath.splitext(filename)[0]
+    return posixpath.join(directory, "variants", f"{stem}-{width}.{format}")
+
+
+def make_variants(name):
+    """Сохраняет уменьшенные копии изображения ``name`` из хранилища.
+
+    Возвращает ``{формат: {ширина: имя файла}}``. Копии не шире
+    оригинала: для маленького изображения все ширины дают одну копию.
+    """
+    with default_storage.open(name) as source, Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+
+        variants = {}
+        for width in constants.IMAGE_VARIANT_WIDTHS:
+            width = min(width, image.width)
+            height = max(round(image.height * width / image.width), 1)
+            resized = image.resize((width, height), Image.Resampling.LANCZOS)
+            for format in get_formats():
+                if str(width) in variants.get(format, {}):
+                    continue
+                target = get_variant_name(name, width, format)
+                if is_content_addressed(name) and default_storage.exists(
+                    target,
+                ):
+                    # Копии файла с тем же содержимым уже созданы.
+                    variants.setdefault(format, {})[str(width)] = target
+                    continue
+                variant = resized
+                if format == "jpeg" and variant.mode == "RGBA":
+                    variant = Image.new("RGB", variant.size, "white")
+                    variant.paste(resized, mask=resized.getchannel("A"))
+                buffer = io.BytesIO()
+                variant.save(
+                    buffer, format=format.upper(),
+                    quality=constants.IMAGE_VARIANT_QUALITY,
+                )
+                variants.setdefault(format, {})[str(width)] = (
+                    default_storage.save(
+                        target, ContentFile(buffer.getvalue()),
+                    )
+                )
+    return variants
+
+
+def make_variants_or_error(name):
+    """Как ``make_variants``, но ошибка возвращается в результате.
+
+    Повреждённый или пропавший файл не должен останавливать обработку
+    остальных изображений и не должен обрабатываться повторно.
+    """
+    try:
+        return make_variants(name)
+    except Exception as error:
+        return {"error": str(error)}
@@ -0,0 +1,157 @@
+import gzip
+import hashlib
+import json
+import threading
+import time
+from bisect import bisect_left
+
+import brotli
+
+from app import constants
+from recipe.models import Ingredient, TableVersion
+
+
+class IngredientIndex:
+    """Индекс названий ингредиентов в памяти процесса.
+
+    Префиксные совпадения ищутся бинарным поиском по отсортированным
+    названиям, совпадения подстрок - пересечением триграмм. Порядок
+    результата тот же, что у ``IngredientFilter``: сначала названия,
+    начинающиеся с запроса, затем содержащие его, внутри групп - по
+    алфавиту. Для запросов короче трёх символов используются униграммы
+    и биграммы.
+    """
+
+    def __init__(self, ingredients):
+        self.items = sorted(
+            (
+                {
+                    "id": ingredient_id,
+                    "name": name,
+                    "measurement_unit": measurement_unit,
+                }
+                for ingredient_id, name, measurement_unit in ingredients
+            ),
+            key=lambda item: (item["name"].casefold(), item["id"]),
+        )
+        self.keys = [item["name"].casefold() for item in self.items]
+        self.ngrams = {}
+        for position, key in enumerate(self.keys):
+            for size in range(1, 4):
+                for ngram in self.get_ngrams(key, size):
+                    self.ngrams.setdefault(ngram, set()).add(position)
+
+    @staticmethod
+    def get_ngrams(value, size):
+        return {value[i:i + size] for i in range(len(value) - size + 1)}
+
+    def search(self, query):
+        query = query.casefold()
+        if not query:
+            return list(self.items)
+
+        start = bisect_left(self.keys, query)
+        end = bisect_left(
+            self.keys, query[:-1] + chr(ord(query[-1]) + 1), start,
+        )
+
+        postings = sorted(
+            (
+                self.ngrams.get(ngram, set())
+                for ngram in self.get_ngrams(query, min(len(query), 3))
+            ),
+            key=len,
+        )
+        candidates = sorted(postings[0].intersection(*postings[1:]))
+
+        contains = [
+            position for position in candidates
+            if not start <= position < end and query in self.keys[position]
+        ]
+        return self.items[start:end] + [
+            self.items[position] for position in contains
+        ]
+
+
+class IngredientSnapshot:
+    """Готовый JSON полного списка ингредиентов и его сжатые варианты.
+
+    Сжатие детерминировано, поэтому у всех процессов одинаковые байты
+    и одинаковые строгие ETag для каждого варианта.
+    """
+
+    encodings = ("br", "gzip")
+
+    def __init__(self, items):
+        body = json.dumps(
+            items, ensure_ascii=False, separators=(",", ":"),
+        ).encode()
+        self.digest = hashlib.sha256(body).hexdigest()[:32]
+        self.bodies = {
+            "identity": body,
+            "gzip": gzip.compress(body, compresslevel=9, mtime=0),
+            "br": brotli.compress(body),
+        }
+
+    def get_etag(self, encoding):
+        return f'"{self.digest}-{encoding}"'
+
+    def negotiate(self, accept_encoding):
+        """Выбирает лучшее сжатие из заголовка Accept-Encoding."""
+        accepted = set()
+        for item in accept_encoding.split(","):
+            coding, _, params = item.strip().partition(";")
+            if params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00"):
+                accepted.add(coding.strip().lower())
+        for encoding in self.encodings:
+            if encoding in accepted or "*" in accepted:
+                return encoding
+        return "identity"
+
+
+class IngredientIndexHolder:
+    """Хранит индекс и снимок процесса, перестраивает их при смене версии.
+
+    Версия таблицы ингредиентов проверяется не чаще, чем раз в
+    ``INGREDIENT_INDEX_REFRESH_INTERVAL`` секунд, поэтому в остальное
+    время ни поиск, ни полный список не обращаются к базе данных.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.index = None
+        self.snapshot = None
+        self.version = None
+        self.checked = None
+
+    def get(self):
+        return self.check().index
+
+    def get_snapshot(self):
+        return self.check().snapshot
+
+    def check(self):
+        with self.lock:
+            now = time.monotonic()
+            if self.checked is None or (
+                now - self.checked
+                >= constants.INGREDIENT_INDEX_REFRESH_INTERVAL
+            ):
+                self.refresh()
+                self.checked = now
+            return self
+
+    def refresh(self):
+        label = Ingredient._meta.label_lower
+        (version,), _ = TableVersion.get_state(label)
+        if self.index is None or version != self.version:
+            self.index = IngredientIndex(
+                Ingredient.objects.values_list(
+                    "id", "name", "measurement_unit",
+                ),
+            )
+            self.snapshot = IngredientSnapshot(self.index.items)
+            self.version = version
+
+
+ingredient_index = IngredientIndexHolder()
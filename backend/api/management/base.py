@@ -0,0 +1,48 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+
+class ProcessPoolCommand(BaseCommand):
+    """Команда, которая в цикле раздаёт работу пулу процессов.
+
+    Подкласс реализует ``step(pool)`` - один проход, возвращающий True,
+    если работа была. Пустой проход завершает команду в режиме ``once``
+    или сменяется паузой ``--poll-interval``.
+    """
+
+    workers_help = "Количество процессов обработки"
+    poll_interval = 1.0
+    poll_interval_help = "Пауза между проверками пустой очереди, секунды"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, default=os.cpu_count() or 1,
+            help=self.workers_help,
+        )
+        parser.add_argument(
+            "--poll-interval", type=float, default=self.poll_interval,
+            help=self.poll_interval_help,
+        )
+
+    def run_pool(self, workers, poll_interval, once):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        # Дочерние процессы не работают с базой, соединения им не нужны.
+        connections.close_all()
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=django.setup,
+        ) as pool:
+            while True:
+                if self.step(pool):
+                    continue
+                if once:
+                    return
+                time.sleep(poll_interval)
+
+    def step(self, pool):
+        raise NotImplementedError
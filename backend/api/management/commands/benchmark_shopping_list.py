@@ -0,0 +1,148 @@
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.shopping_list import (
+    get_pdf_cache_key,
+    get_pdf_style,
+    get_shopping_list,
+    get_shopping_list_pdf,
+    render_pdf,
+)
+from recipe.models import (
+    Cart,
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    ShoppingListItem,
+)
+
+User = get_user_model()
+
+
+class Benchmark(Exception):
+    """Откатывает синтетические данные после замеров."""
+
+
+class Command(BaseCommand):
+    help = "Замер скорости выгрузки списка покупок"  # noqa: VNE003
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes", type=int, nargs="+", default=[10, 100, 1000],
+            help="Количество рецептов в корзине",
+        )
+        parser.add_argument(
+            "--ingredients", type=int, default=5,
+            help="Ингредиентов в одном рецепте",
+        )
+        parser.add_argument(
+            "--repeat", type=int, default=5,
+            help="Количество повторов каждого замера",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(**options)
+                raise Benchmark
+        except Benchmark:
+            pass
+
+    def run(self, sizes, ingredients, repeat, **kwargs):
+        ingredient_pool = Ingredient.objects.bulk_create(
+            Ingredient(name=f"benchmark {i}", measurement_unit="г")
+            for i in range(max(sizes) * 2)
+        )
+        author = User.objects.create_user(
+            email="benchmark@example.com",
+            username="benchmark",
+            first_name="benchmark",
+            last_name="benchmark",
+        )
+
+        self.stdout.write(
+            f"{'рецептов':>9} {'строк':>6} {'запрос':>9} "
+            f"{'без кеша':>9} {'шрифт':>9} {'из кеша':>9}"
+        )
+        for size in sizes:
+            user = User.objects.create_user(
+                email=f"benchmark{size}@example.com",
+                username=f"benchmark{size}",
+                first_name="benchmark",
+                last_name="benchmark",
+            )
+            self.fill_cart(user, author, ingredient_pool, size, ingredients)
+
+            query = self.measure(
+                lambda: list(get_shopping_list(user)), repeat,
+            )
+            rows = list(get_shopping_list(user))
+            key = get_pdf_cache_key(rows)
+
+            def cold():
+                cache.delete(key)
+                get_shopping_list_pdf(rows)
+
+            def font():
+                get_pdf_style.cache_clear()
+                render_pdf(rows)
+
+            cold_time = self.measure(cold, repeat)
+            font_time = self.measure(font, repeat)
+            cached = self.measure(lambda: get_shopping_list_pdf(rows), repeat)
+            cache.delete(key)
+
+            self.stdout.write(
+                f"{size:>9} {len(rows):>6} {query:>7.1f}мс "
+                f"{cold_time:>7.1f}мс {font_time:>7.1f}мс {cached:>7.1f}мс"
+            )
+        self.stdout.write(
+            "запрос - чтение списка из базы, без кеша - сборка PDF, шрифт - "
+            "сборка с повторной регистрацией шрифта, как раньше, "
+            "из кеша - повторная выгрузка той же корзины"
+        )
+
+    @staticmethod
+    def fill_cart(user, author, ingredient_pool, size, ingredients):
+        recipes = Recipe.objects.bulk_create(
+            Recipe(
+                author=author,
+                name=f"benchmark {size}-{i}",
+                image="images/recipes/benchmark.png",
+                text="benchmark",
+                cooking_time=10,
+            )
+            for i in range(size)
+        )
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipe=recipe,
+                ingredient=ingredient_pool[
+                    (i * ingredients + j) % len(ingredient_pool)
+                ],
+                amount=j + 1,
+            )
+            for i, recipe in enumerate(recipes)
+            for j in range(ingredients)
+        )
+        Cart.objects.bulk_create(
+            Cart(user=user, recipe=recipe) for recipe in recipes
+        )
+        ShoppingListItem.add_recipes(
+            user.pk, [recipe.pk for recipe in recipes],
+        )
+
+    @staticmethod
+    def measure(func, repeat):
+        """Медиана времени выполнения в миллисекундах."""
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
@@ -0,0 +1,74 @@
+from api.image_variants import make_variants_or_error
+from api.management.base import ProcessPoolCommand
+from recipe.models import (
+    IMAGE_FIELDS,
+    TableVersion,
+    get_image_version_names,
+)
+from recipe.storage import variants_pending
+
+
+class Command(ProcessPoolCommand):
+    help = "Создание уменьшенных копий изображений"  # noqa: VNE003
+    poll_interval = 5.0
+    poll_interval_help = "Пауза между проверками в режиме --watch, секунды"
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            "--watch", action="store_true",
+            help="Не завершаться, а ждать новые изображения",
+        )
+        parser.add_argument(
+            "--force", action="store_true",
+            help="Пересоздать копии всех изображений",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=100,
+            help="Изображений за один проход",
+        )
+
+    def handle(
+        self, *args, watch, force, workers, batch_size, poll_interval,
+        **kwargs,
+    ):
+        if force:
+            for model, (field, variants_field) in IMAGE_FIELDS.items():
+                model.objects.exclude(**{field: ""}).update(
+                    **{variants_field: {}},
+                )
+        self.batch_size = batch_size
+        self.run_pool(workers, poll_interval, once=not watch)
+
+    def step(self, pool):
+        return sum(
+            self.process(pool, self.batch_size, model, *fields)
+            for model, fields in IMAGE_FIELDS.items()
+        )
+
+    def process(self, pool, batch_size, model, field, variants_field):
+        """Обрабатывает одну порцию изображений без копий."""
+        rows = list(
+            model.objects.filter(variants_pending(field, variants_field))
+            .values_list("pk", field)[:batch_size],
+        )
+        if not rows:
+            return 0
+
+        names = [name for _, name in rows]
+        for (pk, name), variants in zip(
+            rows, pool.map(make_variants_or_error, names),
+        ):
+            # Изображение могло смениться, пока создавались копии.
+            model.objects.filter(pk=pk, **{field: name}).update(
+                **{variants_field: variants},
+            )
+            if "error" in variants:
+                self.stderr.write(f"{name}: {variants['error']}")
+        TableVersion.bump_now(
+            *get_image_version_names(model, [pk for pk, _ in rows]),
+        )
+        self.stdout.write(
+            f"{model._meta.verbose_name_plural}: обработано {len(rows)}",
+        )
+        return len(rows)
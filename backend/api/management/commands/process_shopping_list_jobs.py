@@ -0,0 +1,51 @@
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from api.management.base import ProcessPoolCommand
+from api.shopping_list import (
+    claim_jobs,
+    complete_job,
+    delete_expired_jobs,
+    fail_job,
+    render_pdf,
+)
+
+
+class Command(ProcessPoolCommand):
+    help = "Сборка PDF списков покупок из очереди"  # noqa: VNE003
+    workers_help = "Количество процессов сборки PDF"
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            "--once", action="store_true",
+            help="Обработать текущую очередь и завершиться",
+        )
+
+    def handle(self, *args, workers, poll_interval, once, **kwargs):
+        self.running = {}
+        self.run_pool(workers, poll_interval, once)
+
+    def step(self, pool):
+        for job in claim_jobs(self.workers - len(self.running)):
+            self.running[pool.submit(render_pdf, job.payload)] = job
+
+        if not self.running:
+            deleted = delete_expired_jobs()
+            if deleted:
+                self.stdout.write(f"Удалено старых заданий: {deleted}")
+            return False
+
+        done, _ = wait(
+            self.running, timeout=self.poll_interval,
+            return_when=FIRST_COMPLETED,
+        )
+        for future in done:
+            job = self.running.pop(future)
+            try:
+                complete_job(job, future.result())
+            except Exception as error:
+                fail_job(job, error)
+                self.stderr.write(f"Задание {job.pk}: {error}")
+            else:
+                self.stdout.write(f"Задание {job.pk} готово")
+        return True
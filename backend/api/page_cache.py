@@ -0,0 +1,82 @@
+import hashlib
+
+from django.core.cache import cache
+from rest_framework.response import Response
+
+from app import constants
+
+
+class SharedPageCacheMixin:
+    """Общий для всех пользователей кеш страниц списка.
+
+    В кеше хранится только не зависящая от пользователя часть ответа;
+    ключ включает версии таблиц из ``ConditionalGetMixin``, поэтому
+    любая запись в них делает старые страницы недостижимыми. Поля,
+    зависящие от пользователя, накладываются методом
+    ``overlay_user_state`` после чтения из кеша.
+    """
+
+    page_cache_timeout = constants.PAGE_CACHE_TIMEOUT
+    page_cache_bypass_params = ()
+
+    def list(self, request, *args, **kwargs):
+        if self.bypass_page_cache(request):
+            response = super().list(request, *args, **kwargs)
+        else:
+            key = self.get_page_cache_key(request)
+            data = cache.get(key)
+            if data is None:
+                response = super().list(request, *args, **kwargs)
+                if response.status_code == 200 and self.is_page_consistent(
+                    request,
+                ):
+                    cache.set(key, response.data, self.page_cache_timeout)
+            else:
+                response = Response(data)
+
+        if response.status_code == 200:
+            items = response.data
+            if isinstance(items, dict):
+                items = items["results"]
+            self.overlay_user_state(items)
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        response = super().retrieve(request, *args, **kwargs)
+        if response.status_code == 200:
+            self.overlay_user_state([response.data])
+        return response
+
+    def bypass_page_cache(self, request):
+        """Страницы с фильтрами по данным пользователя не кешируются."""
+        return request.user.is_authenticated and any(
+            request.query_params.get(name) not in (None, "", "0")
+            for name in self.page_cache_bypass_params
+        )
+
+    def is_page_consistent(self, request):
+        """Количество на странице взято по тем же версиям, что и ключ.
+
+        Пагинатор обрезает страницу по количеству, поэтому страницу с
+        количеством по другим версиям таблиц кешировать нельзя.
+        """
+        versions, _ = self.get_table_state(request)
+        return all(
+            versions.get(name) == version
+            for name, version in getattr(self.paginator, "count_versions", ())
+        )
+
+    def get_page_cache_key(self, request):
+        versions, _ = self.get_table_state(request)
+        tables = sorted(
+            (model._meta.label_lower, versions[model._meta.label_lower])
+            for model in self.versioned_models
+        )
+        params = sorted(request.query_params.lists())
+        digest = hashlib.md5(
+            repr((request.get_host(), request.path, params, tables)).encode(),
+        ).hexdigest()
+        return f"page:{digest}"
+
+    def overlay_user_state(self, items):
+        raise NotImplementedError
@@ -1,9 +1,147 @@
-from rest_framework.pagination import PageNumberPagination
+import hashlib
+from functools import cached_property, partial
+
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 from app import constants
+from recipe.models import TableVersion
 
 
 class PagePagination(PageNumberPagination):
     page_size = constants.PAGINATE_COUNT
     page_size_query_param = "limit"
     max_page_size = constants.MAX_PAGE_SIZE
+
+
+class CachedCountPaginator(Paginator):
+    """Paginator, который берёт количество объектов из кеша.
+
+    Для запроса без фильтров на PostgreSQL используется оценка
+    планировщика из pg_class, если таблица достаточно большая.
+    """
+
+    def __init__(self, *args, cache_key, cache_timeout, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_key = cache_key
+        self.cache_timeout = cache_timeout
+
+    @cached_property
+    def count(self):
+        count = cache.get(self.cache_key)
+        if count is None:
+            count = self.estimate_count()
+            if count is None:
+                count = super().count
+            cache.set(self.cache_key, count, self.cache_timeout)
+        return count
+
+    def estimate_count(self):
+        queryset = self.object_list
+        if queryset.query.where:
+            return None
+        connection = connections[queryset.db]
+        if connection.vendor != "postgresql":
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class "
+                "WHERE oid = to_regclass(%s)",
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        if row is None or row[0] < constants.APPROXIMATE_COUNT_THRESHOLD:
+            return None
+        return row[0]
+
+
+class CachedCountPagination(PagePagination):
+    """Постраничная пагинация с кешированием COUNT(*).
+
+    Количество кешируется на короткое время по нормализованному набору
+    параметров фильтрации и версии таблицы модели, поэтому любая запись
+    в таблицу делает старое количество недостижимым. Параметры,
+    зависящие от пользователя, добавляют в ключ его id и версию его
+    избранного, корзины и подписок.
+    """
+
+    count_cache_timeout = constants.COUNT_CACHE_TIMEOUT
+    user_dependent_params = ("is_favorited", "is_in_shopping_cart")
+    user_dependent = False
+
+    @property
+    def django_paginator_class(self):
+        return partial(
+            CachedCountPaginator,
+            cache_key=self.count_cache_key,
+            cache_timeout=self.count_cache_timeout,
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count_cache_key = self.get_count_cache_key(
+            request, queryset, view,
+        )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_count_versions(self, request, queryset, view, user_dependent):
+        """Версии таблиц, от которых зависит количество.
+
+        Если представление уже загрузило версии для ETag или кеша
+        страниц, берутся они: так количество и страница строятся по
+        одному снимку версий.
+        """
+        names = [queryset.model._meta.label_lower]
+        if user_dependent and request.user.is_authenticated:
+            names.append(TableVersion.user_state(request.user.pk))
+        if hasattr(view, "get_table_state"):
+            versions, _ = view.get_table_state(request)
+            if all(name in versions for name in names):
+                return [(name, versions[name]) for name in names]
+        versions, _ = TableVersion.get_state(*names)
+        return list(zip(names, versions))
+
+    def get_count_cache_key(self, request, queryset, view=None):
+        params = sorted(
+            (name, sorted(values))
+            for name, values in request.query_params.lists()
+            if name not in (self.page_query_param, self.page_size_query_param)
+        )
+        user_dependent = self.user_dependent or any(
+            name in self.user_dependent_params for name, _ in params
+        )
+        user_id = request.user.pk if user_dependent else None
+        self.count_versions = self.get_count_versions(
+            request, queryset, view, user_dependent,
+        )
+        key = (request.path, user_id, params, self.count_versions)
+        digest = hashlib.md5(repr(key).encode()).hexdigest()
+        return f"page-count:{digest}"
+
+
+class SubscriptionPagination(CachedCountPagination):
+    user_dependent = True
+
+
+class RecipeCursorPagination(CursorPagination):
+    """Курсорная пагинация ленты рецептов по ключу (-created, id).
+
+    Не выполняет COUNT(*) и OFFSET, поэтому стоимость страницы не зависит
+    от её глубины. Включается параметром ``?pagination=cursor``; вместе с
+    ``?search=`` не используется, чтобы не терять ранжирование.
+    """
+
+    page_size = constants.PAGINATE_COUNT
+    page_size_query_param = "limit"
+    max_page_size = constants.MAX_PAGE_SIZE
+    ordering = ("-created", "id")
+    mode_query_param = "pagination"
+    mode = "cursor"
+
+    @classmethod
+    def is_requested(cls, request):
+        return (
+            request.query_params.get(cls.mode_query_param) == cls.mode
+            or cls.cursor_query_param in request.query_params
+        )
@@ -0,0 +1,41 @@
+from uuid import uuid4
+
+from rest_framework.parsers import DataAndFiles, FileUploadParser
+
+
+class RawImageParser(FileUploadParser):
+    """Изображение, переданное телом запроса с Content-Type image/*.
+
+    Тело потоково записывается обработчиками загрузки во временный
+    файл и попадает в поле ``upload_field`` представления. Имя файла
+    генерируется по типу содержимого, заголовки клиента не используются.
+    Временный файл закрывает ``RawUploadCleanupMixin`` представления.
+    """
+
+    media_type = "image/*"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        upload = super().parse(stream, media_type, parser_context).files
+        field = getattr(parser_context["view"], "upload_field", "image")
+        file = upload["file"]
+        parser_context["request"].raw_uploads = [file]
+        return DataAndFiles({}, {field: file})
+
+    def get_filename(self, stream, media_type, parser_context):
+        subtype = media_type.split(";")[0].split("/")[-1].strip()
+        return f"{uuid4()}.{subtype}"
+
+
+class RawUploadCleanupMixin:
+    """Закрывает и удаляет временные файлы ``RawImageParser`` после ответа.
+
+    Django сам закрывает только файлы из multipart-запроса.
+    """
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request, response, *args, **kwargs,
+        )
+        for file in getattr(request, "raw_uploads", ()):
+            file.close()
+        return response
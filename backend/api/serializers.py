@@ -4,20 +4,63 @@ from uuid import uuid4
 
 from django.contrib.auth.password_validation import validate_password
 from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import prefetch_related_objects
+from PIL import Image
 from rest_framework.exceptions import PermissionDenied, ValidationError
 from rest_framework import serializers
 
+from app import constants
 from recipe.models import (
-    Cart,
-    Favorite,
     Ingredient,
     Recipe,
     RecipeIngredient,
+    ShoppingListItem,
+    TableVersion,
     Tag,
+    insert_ignoring_conflicts,
 )
 from users.models import Subscribtion, User
 
 
+def get_subscribed_author_ids(request):
+    """Множество id авторов, на которых подписан пользователь запроса.
+
+    Загружается одним запросом и кешируется на объекте запроса.
+    """
+    if not request.user.is_authenticated:
+        return frozenset()
+    if not hasattr(request, "subscribed_author_ids"):
+        request.subscribed_author_ids = frozenset(
+            Subscribtion.objects.filter(user=request.user).values_list(
+                "author_id", flat=True,
+            ),
+        )
+    return request.subscribed_author_ids
+
+
+class ImageVariantsField(serializers.ReadOnlyField):
+    """Адреса уменьшенных копий изображения: ``{формат: {ширина: url}}``.
+
+    Пока копии не созданы, отдаётся пустой словарь.
+    """
+
+    def to_representation(self, value):
+        request = self.context.get("request")
+        variants = {}
+        for format, names in value.items():
+            if not isinstance(names, dict):
+                continue
+            variants[format] = {}
+            for width, name in names.items():
+                url = default_storage.url(name)
+                if request is not None:
+                    url = request.build_absolute_uri(url)
+                variants[format][width] = url
+        return variants
+
+
 class UserShortSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -33,11 +76,13 @@ class UserShortSerializer(serializers.ModelSerializer):
 class UserSerializer(UserShortSerializer):
     is_subscribed = serializers.SerializerMethodField()
     avatar = serializers.ImageField(use_url=True, read_only=True)
+    avatar_variants = ImageVariantsField()
 
     class Meta(UserShortSerializer.Meta):
         fields = UserShortSerializer.Meta.fields + [
             "is_subscribed",
             "avatar",
+            "avatar_variants",
         ]
 
     def validate_username(self, value):
@@ -54,11 +99,9 @@ class UserSerializer(UserShortSerializer):
         return value
 
     def get_is_subscribed(self, obj):
-        if not self.context["request"].user.is_authenticated:
-            return False
-        return Subscribtion.objects.filter(
-            author=obj, user=self.context["request"].user,
-        ).exists()
+        if hasattr(obj, "is_subscribed"):
+            return obj.is_subscribed
+        return obj.id in get_subscribed_author_ids(self.context["request"])
 
 
 class UserWriteSerializer(serializers.ModelSerializer):
@@ -113,27 +156,28 @@ class TagSerializer(serializers.ModelSerializer):
 
 
 class ShortRecipeSerializer(serializers.ModelSerializer):
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = Recipe
-        fields = ["id", "name", "image", "cooking_time"]
+        fields = ["id", "name", "image", "image_variants", "cooking_time"]
 
 
-class IngredientSerializer(serializers.ModelSerializer):
-    amount = serializers.SerializerMethodField()
+class RecipeIngredientSerializer(serializers.ModelSerializer):
+    """Ингредиент рецепта, собранный из строки RecipeIngredient."""
+
+    id = serializers.IntegerField(  # noqa VNE003
+        source="ingredient.id", read_only=True,
+    )
+    name = serializers.CharField(source="ingredient.name", read_only=True)
+    measurement_unit = serializers.CharField(
+        source="ingredient.measurement_unit", read_only=True,
+    )
 
     class Meta:
-        model = Ingredient
+        model = RecipeIngredient
         fields = ["id", "name", "measurement_unit", "amount"]
 
-    def get_amount(self, obj):
-        return (
-            RecipeIngredient.objects.filter(
-                ingredient=obj, recipe=self.context["recipe"],
-            )
-            .first()
-            .amount
-        )
-
 
 class IngredientSingleSerializer(serializers.ModelSerializer):
     class Meta:
@@ -142,12 +186,20 @@ class IngredientSingleSerializer(serializers.ModelSerializer):
 
 
 class Base64ImageField(serializers.ImageField):
-    """Поле для работы с base64 изображениями."""
+    """Поле изображения: base64-строка или загруженный файл.
+
+    Размер файла и размеры изображения проверяются по заголовку до
+    полного декодирования, base64-строка - до раскодирования.
+    """
 
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith("data:image"):
             try:
                 format, imgstr = data.split(";base64,")
+                if len(imgstr) * 3 // 4 > constants.MAX_IMAGE_SIZE:
+                    raise ValidationError({
+                        "field_name": ["Изображение слишком большое"],
+                    })
                 ext = format.split("/")[-1]
                 file_name = f"{uuid4()}.{ext}"
                 data = ContentFile(base64.b64decode(imgstr), name=file_name)
@@ -155,22 +207,40 @@ class Base64ImageField(serializers.ImageField):
                 raise ValidationError({
                     "field_name": ["Не удалось загрузить изображение"],
                 })
+        if hasattr(data, "size") and hasattr(data, "seek"):
+            self.check_image(data)
         return super().to_internal_value(data)
 
+    def check_image(self, file):
+        if file.size > constants.MAX_IMAGE_SIZE:
+            raise ValidationError({
+                "field_name": ["Изображение слишком большое"],
+            })
+        source = file
+        if hasattr(file, "temporary_file_path"):
+            source = file.temporary_file_path()
+        try:
+            with Image.open(source) as image:
+                width, height = image.size
+        except Image.DecompressionBombError:
+            width = height = constants.MAX_IMAGE_SIDE + 1
+        except (OSError, ValueError):
+            self.fail("invalid_image")
+        finally:
+            file.seek(0)
+        if (
+            max(width, height) > constants.MAX_IMAGE_SIDE
+            or width * height > constants.MAX_IMAGE_PIXELS
+        ):
+            raise ValidationError({
+                "field_name": ["Слишком большое разрешение изображения"],
+            })
+
 
 class IngredientAmountSerializer(serializers.Serializer):
     id = serializers.IntegerField()  # noqa VNE003
     amount = serializers.IntegerField(min_value=1)
 
-    def validate_id(self, value):
-        """Validate that ingredient exists."""
-        if not Ingredient.objects.filter(id=value).exists():
-            raise ValidationError({
-                "field_name":
-                ["Ингредиента с таким id не существует"],
-            })
-        return value
-
 
 class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
     """Сериализатор для создания и обновления рецептов для write операций."""
@@ -237,6 +307,23 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
             raise ValidationError({
                 "field_name": ["Ингредиенты не должны повторяться"],
             })
+
+        existing_ids = set(
+            Ingredient.objects.filter(
+                id__in=ingredient_ids,
+            ).values_list("id", flat=True),
+        )
+        unknown_ids = [
+            ingredient_id for ingredient_id in ingredient_ids
+            if ingredient_id not in existing_ids
+        ]
+        if unknown_ids:
+            raise ValidationError({
+                "field_name": [
+                    "Ингредиентов с такими id не существует: "
+                    + ", ".join(map(str, unknown_ids)),
+                ],
+            })
         return value
 
     def validate_tags(self, value):
@@ -258,22 +345,54 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
         if instance and instance.author != self.context["request"].user:
             raise PermissionDenied("Нельзя редактировать чужой рецепт")
 
-    def create_ingredients_and_tags(self, recipe, tags, ingredients_data):
-        """Создание связанных ингредиентов и тегов."""
-        recipe.tags.set(tags)
-
-        recipe_ingredients = [
-            RecipeIngredient(
-                recipe=recipe,
-                ingredient_id=item["id"],
-                amount=item["amount"],
+    def set_ingredients(self, recipe, ingredients_data):
+        """Приводит ингредиенты рецепта к ``ingredients_data``.
+
+        Изменённые количества обновляются одним ``bulk_update``, лишние
+        строки удаляются, недостающие создаются; совпадающие строки не
+        переписываются.
+        """
+        current = {}
+        stale_ids = []
+        old_amounts = {}
+        for item in RecipeIngredient.objects.filter(recipe=recipe).only(
+            "id", "ingredient_id", "amount",
+        ):
+            old_amounts[item.ingredient_id] = (
+                old_amounts.get(item.ingredient_id, 0) + item.amount
             )
-            for item in ingredients_data
-        ]
+            if item.ingredient_id in current:
+                stale_ids.append(item.pk)
+            else:
+                current[item.ingredient_id] = item
 
-        RecipeIngredient.objects.bulk_create(recipe_ingredients)
-        return recipe
+        new_amounts = {item["id"]: item["amount"] for item in ingredients_data}
+        ShoppingListItem.change_recipe(recipe.pk, old_amounts, new_amounts)
 
+        stale_ids.extend(
+            item.pk for ingredient_id, item in current.items()
+            if ingredient_id not in new_amounts
+        )
+        changed = []
+        created = []
+        for ingredient_id, amount in new_amounts.items():
+            item = current.get(ingredient_id)
+            if item is None:
+                created.append(RecipeIngredient(
+                    recipe=recipe, ingredient_id=ingredient_id, amount=amount,
+                ))
+            elif item.amount != amount:
+                item.amount = amount
+                changed.append(item)
+
+        if stale_ids:
+            RecipeIngredient.objects.filter(pk__in=stale_ids).delete()
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ["amount"])
+        if created:
+            RecipeIngredient.objects.bulk_create(created)
+
+    @transaction.atomic
     def create(self, validated_data):
         """Создание рецепта."""
         ingredients_data = validated_data.pop("ingredients")
@@ -281,11 +400,24 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
         author = self.context["request"].user
 
         recipe = Recipe.objects.create(author=author, **validated_data)
-        self.create_ingredients_and_tags(recipe, tags, ingredients_data)
+        recipe.tags.add(*tags)
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipe=recipe,
+                ingredient_id=item["id"],
+                amount=item["amount"],
+            )
+            for item in ingredients_data
+        )
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        """Обновление рецепта."""
+        """Обновление рецепта.
+
+        Теги и ингредиенты сравниваются с текущими, и в связующие
+        таблицы записываются только отличия.
+        """
         self.validate_permissions(instance)
 
         ingredients_data = validated_data.pop("ingredients", None)
@@ -295,14 +427,10 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
             setattr(instance, attr, value)
         instance.save()
 
-        if ingredients_data is not None or tags is not None:
-            if ingredients_data is not None:
-                RecipeIngredient.objects.filter(recipe=instance).delete()
-            self.create_ingredients_and_tags(
-                instance,
-                tags if tags is not None else instance.tags.all(),
-                ingredients_data or [],
-            )
+        if tags is not None:
+            instance.tags.set(tags)
+        if ingredients_data is not None:
+            self.set_ingredients(instance, ingredients_data)
 
         return instance
 
@@ -310,17 +438,25 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
         """Return representation using the read serializer."""
         instance.is_favorited = False
         instance.is_in_shopping_cart = False
+        prefetch_related_objects(
+            [instance], "tags", "recipe_ingredients__ingredient",
+        )
         return RecipeSerializer(instance, context=self.context).data
 
 
 class RecipeSerializer(serializers.ModelSerializer):
-    is_favorited = serializers.BooleanField(read_only=True)
-    is_in_shopping_cart = serializers.BooleanField(read_only=True)
+    is_favorited = serializers.BooleanField(read_only=True, default=False)
+    is_in_shopping_cart = serializers.BooleanField(
+        read_only=True, default=False,
+    )
     image = serializers.SerializerMethodField()
     tags = TagSerializer(many=True, read_only=True)
     author = UserSerializer()
-    ingredients = serializers.SerializerMethodField()
+    ingredients = RecipeIngredientSerializer(
+        source="recipe_ingredients", many=True, read_only=True,
+    )
     image = serializers.ImageField(use_url=True)
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Recipe
@@ -333,14 +469,17 @@ class RecipeSerializer(serializers.ModelSerializer):
             "is_in_shopping_cart",
             "name",
             "image",
+            "image_variants",
             "text",
             "cooking_time",
         ]
 
-    def get_ingredients(self, obj):
-        return IngredientSerializer(
-            obj.ingredients.all(), many=True, context={"recipe": obj},
-        ).data
+    def __init__(self, *args, fields=None, **kwargs):
+        """Оставляет только поля из ``fields``, если они переданы."""
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
 
 
 class UserWithRecipesSerializer(UserSerializer):
@@ -363,59 +502,47 @@ class UserWithRecipesSerializer(UserSerializer):
         return ShortRecipeSerializer(recipes, many=True).data
 
 
-class SubscribtionSerializer(serializers.ModelSerializer):
-    author = serializers.PrimaryKeyRelatedField(queryset=User.objects.all())
-
-    class Meta:
-        model = Subscribtion
-        fields = ["author"]
+class SubscribtionSerializer(serializers.Serializer):
+    author = serializers.IntegerField()
 
     def validate_author(self, author):
         user = self.context["request"].user
 
-        if author == user:
+        if author == user.pk:
             raise ValidationError(
                 "Нельзя подписаться на самого себя",
             )
-
-        if Subscribtion.objects.filter(user=user, author=author).exists():
-            raise ValidationError("Подписка уже существует")
-
         return author
 
     def create(self, validated_data):
+        """Создаёт подписку одним запросом без предварительной проверки."""
         user = self.context["request"].user
         author = validated_data["author"]
-        return Subscribtion.objects.create(user=user, author=author)
-
-
-class BaseUserRecipeSerializer(serializers.ModelSerializer):
-    """Базовый сериализатор для моделей с полями user и recipe."""
-
-    class Meta:
-        fields = ("user", "recipe")
-        abstract = True
+        created = insert_ignoring_conflicts(
+            Subscribtion, [{"user": user.pk, "author": author}],
+        )
+        if not created:
+            raise ValidationError({"author": ["Подписка уже существует"]})
+        TableVersion.bump(TableVersion.user_state(user.pk))
+        return Subscribtion(pk=created[0], user=user, author_id=author)
 
-    def validate(self, data):
-        model = self.Meta.model
-        user = data["user"]
-        recipe = data["recipe"]
 
-        if model.objects.filter(user=user, recipe=recipe).exists():
-            raise ValidationError(
-                f"Этот рецепт уже есть в {model.__name__}.",
-            )
-        return data
+class RecipeIdsSerializer(serializers.Serializer):
+    """Список id рецептов для пакетного добавления и удаления."""
 
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=constants.MAX_BULK_RECIPES,
+    )
 
-class FavoriteSerializer(BaseUserRecipeSerializer):
-    class Meta(BaseUserRecipeSerializer.Meta):
-        model = Favorite
 
+class RecipeImageSerializer(serializers.ModelSerializer):
+    image = Base64ImageField()
 
-class CartSerializer(BaseUserRecipeSerializer):
-    class Meta(BaseUserRecipeSerializer.Meta):
-        model = Cart
+    class Meta:
+        model = Recipe
+        fields = ["image"]
 
 
 class AvatarSerializer(serializers.ModelSerializer):
@@ -432,14 +559,15 @@ class AvatarSerializer(serializers.ModelSerializer):
                 "field_name": ["Отсутствует обязательное поле 'avatar'"],
             })
         instance.avatar = validated_data.get("avatar", instance.avatar)
-        instance.save()
+        instance.save(update_fields=["avatar", "avatar_variants"])
         return instance
 
     def delete_avatar(self):
         """Handle avatar deletion."""
         user = self.instance
         if user.avatar:
-            user.avatar.delete(save=True)
+            user.avatar.delete(save=False)
+            user.save(update_fields=["avatar", "avatar_variants"])
         return user
 
     def to_representation(self, instance):
@@ -0,0 +1,221 @@
+import csv
+import hashlib
+import io
+import json
+from datetime import timedelta
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer
+
+from app import constants
+from recipe.models import ShoppingListItem, ShoppingListJob
+
+FONT_NAME = "DejaVuSans"
+CSV_HEADER = ("name", "measurement_unit", "amount")
+
+
+def get_shopping_list(user):
+    """Суммарное количество каждого ингредиента в корзине пользователя.
+
+    Читается из поддерживаемой таблицы ``ShoppingListItem`` по индексу
+    пользователя; строки содержат name, measurement_unit и amount и
+    отсортированы по названию.
+    """
+    return (
+        ShoppingListItem.objects.filter(user=user)
+        .values(
+            name=F("ingredient__name"),
+            measurement_unit=F("ingredient__measurement_unit"),
+            amount=F("total_amount"),
+        )
+        .order_by("name")
+    )
+
+
+def get_shopping_list_summary(user):
+    """Строки списка покупок с id ингредиента и числом рецептов."""
+    return get_shopping_list(user).values(
+        "name",
+        "measurement_unit",
+        "amount",
+        "recipe_count",
+        id=F("ingredient_id"),
+    )
+
+
+def iter_shopping_list(user):
+    """Строки списка покупок, читаемые из базы порциями."""
+    return get_shopping_list(user).iterator(
+        chunk_size=constants.SHOPPING_LIST_CHUNK_SIZE,
+    )
+
+
+class Echo:
+    """Буфер для csv.writer, возвращающий записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+def stream_text(rows):
+    yield "Список ингредиентов:\n"
+    for row in rows:
+        yield (
+            f'- {row["name"]}: {row["amount"]} {row["measurement_unit"]}\n'
+        )
+
+
+def stream_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADER)
+    for row in rows:
+        yield writer.writerow([row[field] for field in CSV_HEADER])
+
+
+def stream_json(rows):
+    separator = ""
+    yield "["
+    for row in rows:
+        yield separator + json.dumps(row, ensure_ascii=False)
+        separator = ","
+    yield "]"
+
+
+# Потоковые форматы выгрузки: генератор, Content-Type и признак вложения
+STREAM_FORMATS = {
+    "txt": (stream_text, "text/plain; charset=utf-8", True),
+    "csv": (stream_csv, "text/csv; charset=utf-8", True),
+    "json": (stream_json, "application/json", False),
+}
+
+
+@lru_cache(maxsize=None)
+def get_pdf_style():
+    """Регистрирует шрифт и создаёт стиль один раз на процесс."""
+    font_path = settings.BASE_DIR / "static" / "fonts" / "DejaVuSans.ttf"
+    pdfmetrics.registerFont(TTFont(FONT_NAME, font_path))
+
+    style = getSampleStyleSheet()["Normal"]
+    style.fontName = FONT_NAME
+    return style
+
+
+def render_pdf(ingredients):
+    """Собирает PDF со списком ингредиентов и возвращает его байты."""
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer)
+    style = get_pdf_style()
+
+    elements = []
+    elements.append(Paragraph("Список ингредиентов:", style))
+    elements.append(Spacer(1, 10))
+
+    for i, ingredient in enumerate(ingredients):
+        if i == len(ingredients) - 1:
+            line = (
+                f'- {ingredient["name"]}: {ingredient["amount"]} '
+                f'{ingredient["measurement_unit"]}.'
+            )
+            elements.append(Paragraph(line, style))
+        else:
+            line = (
+                f'- {ingredient["name"]}: {ingredient["amount"]} '
+                f'{ingredient["measurement_unit"]};'
+            )
+            elements.append(Paragraph(line, style))
+            elements.append(Spacer(1, 6))
+
+    doc.build(elements)
+    return buffer.getvalue()
+
+
+def get_pdf_cache_key(ingredients):
+    digest = hashlib.sha256(
+        json.dumps(ingredients, ensure_ascii=False, sort_keys=True).encode(),
+    ).hexdigest()
+    return f"shopping-list-pdf:{digest}"
+
+
+def get_shopping_list_pdf(ingredients):
+    """PDF для списка ингредиентов из кеша или заново собранный.
+
+    Ключ кеша - хеш самого списка, поэтому одинаковые корзины разных
+    пользователей делят один PDF, а любое изменение корзины или
+    ингредиентов даёт новый ключ и не требует инвалидации.
+    """
+    pdf = get_cached_pdf(ingredients)
+    if pdf is None:
+        pdf = render_pdf(ingredients)
+        cache_pdf(ingredients, pdf)
+    return pdf
+
+
+def get_cached_pdf(ingredients):
+    return cache.get(get_pdf_cache_key(ingredients))
+
+
+def cache_pdf(ingredients, pdf):
+    cache.set(
+        get_pdf_cache_key(ingredients), pdf, constants.PDF_CACHE_TIMEOUT,
+    )
+
+
+def claim_jobs(limit):
+    """Забирает из очереди до ``limit`` заданий и отмечает их начатыми.
+
+    Строки блокируются с SKIP LOCKED, поэтому несколько обработчиков не
+    получат одно задание. Задания, зависшие в работе дольше
+    ``SHOPPING_LIST_JOB_TIMEOUT``, выдаются повторно.
+    """
+    if limit <= 0:
+        return []
+    now = timezone.now()
+    stale = now - timedelta(seconds=constants.SHOPPING_LIST_JOB_TIMEOUT)
+    Status = ShoppingListJob.Status
+    with transaction.atomic():
+        jobs = list(
+            ShoppingListJob.objects.filter(
+                Q(status=Status.PENDING)
+                | Q(status=Status.RUNNING, started__lt=stale),
+            )
+            .order_by("created")
+            .select_for_update(skip_locked=True)
+            .only("id", "payload")[:limit],
+        )
+        ShoppingListJob.objects.filter(
+            pk__in=[job.pk for job in jobs],
+        ).update(status=Status.RUNNING, started=now)
+    return jobs
+
+
+def complete_job(job, pdf):
+    cache_pdf(job.payload, pdf)
+    ShoppingListJob.objects.filter(pk=job.pk).update(
+        status=ShoppingListJob.Status.DONE,
+        result=pdf,
+        finished=timezone.now(),
+    )
+
+
+def fail_job(job, error):
+    ShoppingListJob.objects.filter(pk=job.pk).update(
+        status=ShoppingListJob.Status.FAILED,
+        error=str(error),
+        finished=timezone.now(),
+    )
+
+
+def delete_expired_jobs():
+    """Удаляет задания, завершённые дольше ``SHOPPING_LIST_JOB_TTL`` назад."""
+    expired = timezone.now() - timedelta(
+        seconds=constants.SHOPPING_LIST_JOB_TTL,
+    )
+    return ShoppingListJob.objects.filter(finished__lt=expired).delete()[0]
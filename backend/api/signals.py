@@ -0,0 +1,37 @@
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from api.authentication import invalidate_tokens
+from users.models import User
+
+
+@receiver(post_delete, sender=Token)
+def forget_token(sender, instance, **kwargs):
+    """Выход из системы удаляет токен - убираем его и из кеша."""
+    transaction.on_commit(partial(invalidate_tokens, instance.key))
+
+
+@receiver(post_save, sender=User)
+def forget_user_tokens(sender, instance, created, update_fields=None,
+                       **kwargs):
+    """Смена пароля, блокировка и правка профиля сбрасывают кеш токенов.
+
+    Без общего кеша записи процессов устаревают сами за
+    ``TOKEN_CACHE_LOCAL_TIMEOUT`` секунд, и токены не запрашиваются.
+    """
+    if not settings.TOKEN_CACHE_SHARED or created:
+        return
+    if update_fields and set(update_fields) <= {"last_login"}:
+        return
+    keys = list(
+        Token.objects.filter(user_id=instance.pk).values_list(
+            "key", flat=True,
+        ),
+    )
+    if keys:
+        transaction.on_commit(partial(invalidate_tokens, *keys))
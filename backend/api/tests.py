@@ -0,0 +1,1231 @@
+import base64
+import io
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
+
+import brotli
+from django.core import serializers
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import (
+    SimpleUploadedFile,
+    TemporaryUploadedFile,
+)
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.authentication import token_cache
+from api.image_variants import get_variant_name
+from api.ingredient_index import ingredient_index
+from api.paginator import CachedCountPagination
+from api.management.commands.make_image_variants import (
+    Command as ImageVariantsCommand,
+)
+from api.shopping_list import (
+    claim_jobs,
+    complete_job,
+    get_shopping_list,
+    render_pdf,
+)
+from app import constants
+from recipe.models import (
+    Cart,
+    Favorite,
+    Ingredient,
+    MediaFile,
+    Recipe,
+    RecipeIngredient,
+    ShoppingListItem,
+    Tag,
+)
+from recipe.storage import content_storage, is_content_addressed
+from users.models import Subscribtion, User
+
+SMALL_PAGE = 2
+LARGE_PAGE = 20
+
+
+@override_settings(
+    PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"],
+)
+class QueryBudgetTestCase(TestCase):
+    """Бюджет SQL-запросов не должен расти вместе с размером страницы."""
+
+    recipes_count = LARGE_PAGE
+    ingredients_per_recipe = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tags = Tag.objects.bulk_create(
+            Tag(name=f"Тег {i}", slug=f"tag-{i}") for i in range(3)
+        )
+        cls.ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f"Ингредиент {i}", measurement_unit="г")
+            for i in range(cls.ingredients_per_recipe * 2)
+        )
+        cls.authors = [
+            User.objects.create_user(
+                email=f"author{i}@example.com",
+                username=f"author{i}",
+                first_name="Имя",
+                last_name="Фамилия",
+                password="password1",
+            )
+            for i in range(LARGE_PAGE)
+        ]
+        cls.user = User.objects.create_user(
+            email="reader@example.com",
+            username="reader",
+            first_name="Имя",
+            last_name="Фамилия",
+            password="password1",
+        )
+        Subscribtion.objects.bulk_create(
+            Subscribtion(user=cls.user, author=author)
+            for author in cls.authors[::2]
+        )
+        for i in range(cls.recipes_count):
+            recipe = Recipe.objects.create(
+                author=cls.authors[i % len(cls.authors)],
+                name=f"Рецепт {i}",
+                image="images/recipes/test.png",
+                text="Описание",
+                cooking_time=10,
+            )
+            recipe.tags.set(cls.tags[: i % len(cls.tags) + 1])
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(
+                    recipe=recipe, ingredient=ingredient, amount=j + 1,
+                )
+                for j, ingredient in enumerate(
+                    cls.ingredients[i % 2::2][: cls.ingredients_per_recipe],
+                )
+            )
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def count_queries(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(context.captured_queries)
+
+    def assert_budget(self, url, budget):
+        """Проверяет бюджет запросов для маленькой и большой страницы.
+
+        На PostgreSQL для списка без фильтров добавляется запрос оценки
+        количества строк из pg_class.
+        """
+        if connection.vendor == "postgresql":
+            budget += 1
+        separator = "&" if "?" in url else "?"
+        small = self.count_queries(f"{url}{separator}limit={SMALL_PAGE}")
+        large = self.count_queries(f"{url}{separator}limit={LARGE_PAGE}")
+        self.assertEqual(
+            small, large, "Число запросов растёт вместе с размером страницы",
+        )
+        self.assertLessEqual(large, budget)
+
+
+class RecipeQueryBudgetTests(QueryBudgetTestCase):
+
+    def test_recipe_list(self):
+        self.assert_budget("/api/recipes/", budget=5)
+
+    def test_recipe_list_filtered_by_tags(self):
+        self.assert_budget(
+            f"/api/recipes/?tags={self.tags[0].slug}&tags={self.tags[1].slug}",
+            budget=5,
+        )
+
+    def test_recipe_list_tags_or_semantics(self):
+        slugs = [self.tags[0].slug, self.tags[1].slug]
+        expected = set(
+            Recipe.objects.filter(tags__slug__in=slugs).values_list(
+                "id", flat=True,
+            ),
+        )
+        queries = (
+            f"tags={slugs[0]}&tags={slugs[1]}",
+            f"tags={','.join(slugs)}",
+        )
+        for query in queries:
+            data = self.client.get(
+                f"/api/recipes/?{query}&limit={LARGE_PAGE}",
+            ).json()
+            ids = [recipe["id"] for recipe in data["results"]]
+            self.assertEqual(len(ids), len(set(ids)))
+            self.assertEqual(set(ids), expected)
+            self.assertEqual(data["count"], len(expected))
+
+    def test_recipe_list_cursor(self):
+        self.assert_budget("/api/recipes/?pagination=cursor", budget=4)
+
+    def test_recipe_list_cursor_walks_all_pages(self):
+        url = f"/api/recipes/?pagination=cursor&limit={SMALL_PAGE + 1}"
+        seen = []
+        while url:
+            data = self.client.get(url).json()
+            seen.extend(recipe["id"] for recipe in data["results"])
+            url = data["next"]
+        self.assertEqual(
+            seen,
+            list(
+                Recipe.objects.order_by("-created", "id").values_list(
+                    "id", flat=True,
+                ),
+            ),
+        )
+
+    def test_recipe_list_count_is_cached(self):
+        url = f"/api/recipes/?tags=tag-0&limit={SMALL_PAGE}"
+        cold = self.count_queries(url)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(f"{url}&page=2")
+        self.assertEqual(len(context.captured_queries), cold - 1)
+        self.assertEqual(
+            response.json()["count"],
+            Recipe.objects.filter(tags__slug="tag-0").count(),
+        )
+
+    def test_recipe_list_sparse_fields(self):
+        url = "/api/recipes/?fields=id,name,image,cooking_time"
+        self.client.force_authenticate(self.user)
+        self.assert_budget(url, budget=3)
+        recipe = self.client.get(url).json()["results"][0]
+        self.assertEqual(
+            set(recipe), {"id", "name", "image", "cooking_time"},
+        )
+
+    def test_recipe_list_omit_fields(self):
+        url = "/api/recipes/?omit=ingredients,text"
+        self.assert_budget(url, budget=4)
+        recipe = self.client.get(url).json()["results"][0]
+        self.assertNotIn("ingredients", recipe)
+        self.assertNotIn("text", recipe)
+        self.assertIn("author", recipe)
+
+    def test_recipe_page_cache_is_shared(self):
+        url = f"/api/recipes/?limit={LARGE_PAGE}"
+        self.count_queries(url)
+        recipe = Recipe.objects.first()
+        Favorite.objects.create(user=self.user, recipe=recipe)
+        self.client.force_authenticate(self.user)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(len(context.captured_queries), 3)
+        subscribed = {author.id for author in self.authors[::2]}
+        for item in response.json()["results"]:
+            self.assertEqual(item["is_favorited"], item["id"] == recipe.id)
+            self.assertEqual(
+                item["author"]["is_subscribed"],
+                item["author"]["id"] in subscribed,
+            )
+
+    def test_recipe_detail(self):
+        recipe = Recipe.objects.first()
+        self.assertLessEqual(
+            self.count_queries(f"/api/recipes/{recipe.id}/"), 4,
+        )
+
+    def test_recipe_ingredients_amounts(self):
+        recipe = Recipe.objects.first()
+        response = self.client.get(f"/api/recipes/{recipe.id}/")
+        expected = {
+            item.ingredient_id: item.amount
+            for item in recipe.recipe_ingredients.all()
+        }
+        self.assertEqual(
+            {
+                item["id"]: item["amount"]
+                for item in response.json()["ingredients"]
+            },
+            expected,
+        )
+
+    def test_recipe_list_authenticated(self):
+        self.client.force_authenticate(self.user)
+        self.assert_budget("/api/recipes/", budget=7)
+
+    def test_recipe_author_is_subscribed(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get(f"/api/recipes/?limit={LARGE_PAGE}")
+        subscribed = {author.id for author in self.authors[::2]}
+        for recipe in response.json()["results"]:
+            author = recipe["author"]
+            self.assertEqual(
+                author["is_subscribed"], author["id"] in subscribed,
+            )
+
+
+class UserQueryBudgetTests(QueryBudgetTestCase):
+
+    def test_user_list(self):
+        self.assert_budget("/api/users/", budget=3)
+
+    def test_user_list_authenticated(self):
+        self.client.force_authenticate(self.user)
+        self.assert_budget("/api/users/", budget=3)
+
+    def test_subscriptions(self):
+        self.client.force_authenticate(self.user)
+        self.assert_budget(
+            "/api/users/subscriptions/?recipes_limit=1", budget=4,
+        )
+
+    def test_recipes_limit_applied_in_database(self):
+        author = self.authors[0]
+        newest = [
+            Recipe.objects.create(
+                author=author,
+                name=f"Новый {i}",
+                image="images/recipes/test.png",
+                text="Описание",
+                cooking_time=10,
+            ).pk
+            for i in range(3)
+        ]
+        for days, pk in enumerate(newest):
+            Recipe.objects.filter(pk=pk).update(
+                created=timezone.now() + timedelta(days=days + 1),
+            )
+        self.client.force_authenticate(self.user)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(
+                "/api/users/subscriptions/?recipes_limit=2&limit=100",
+            )
+        card = next(
+            card for card in response.json()["results"]
+            if card["id"] == author.pk
+        )
+        self.assertEqual(card["recipes_count"], 4)
+        self.assertEqual(
+            [recipe["id"] for recipe in card["recipes"]], newest[:0:-1],
+        )
+        recipes_sql = next(
+            query["sql"] for query in context.captured_queries
+            if "ROW_NUMBER" in query["sql"]
+        )
+        self.assertNotIn('"text"', recipes_sql)
+
+    def test_cached_count_follows_writes(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+        url = "/api/users/subscriptions/"
+        count = self.client.get(url).json()["count"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f"/api/users/{self.authors[1].pk}/subscribe/")
+        response = self.client.get(url).json()
+        self.assertEqual(response["count"], count + 1)
+        self.assertIn(
+            self.authors[1].pk,
+            [author["id"] for author in response["results"]],
+        )
+
+
+@override_settings(TOKEN_CACHE_SHARED=True)
+class TokenCacheTests(QueryBudgetTestCase):
+    recipes_count = 0
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        token_cache.clear()
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+
+    def get_me(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get("/api/users/me/")
+        return response, len(context.captured_queries)
+
+    def test_repeat_request_skips_token_query(self):
+        response, first = self.get_me()
+        self.assertEqual(response.status_code, 200)
+        response, second = self.get_me()
+        self.assertEqual(response.json()["id"], self.user.pk)
+        self.assertEqual(second, first - 1)
+
+    def test_password_change_and_logout_invalidate(self):
+        self.get_me()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.set_password("new-password")
+            self.user.save()
+        _, queries = self.get_me()
+        _, cached = self.get_me()
+        self.assertEqual(queries, cached + 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.get_me()[0].status_code, 401)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = True
+            self.user.save()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post("/api/auth/token/logout/")
+        self.assertEqual(self.get_me()[0].status_code, 401)
+
+    def test_other_worker_entry_is_rejected_after_logout(self):
+        self.get_me()
+        # Кеш другого процесса выход из системы не затрагивает
+        entries = dict(token_cache.entries)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post("/api/auth/token/logout/")
+        token_cache.entries.update(entries)
+        self.assertEqual(self.get_me()[0].status_code, 401)
+
+    @override_settings(TOKEN_CACHE_SHARED=False)
+    def test_local_mode_caches_for_a_short_time(self):
+        _, first = self.get_me()
+        response, second = self.get_me()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(second, first - 1)
+
+        with CaptureQueriesContext(connection) as context:
+            self.user.first_name = "Другое"
+            self.user.save()
+        self.assertFalse(any(
+            Token._meta.db_table in query["sql"]
+            for query in context.captured_queries
+        ))
+
+        expired = time.monotonic() + constants.TOKEN_CACHE_LOCAL_TIMEOUT
+        with mock.patch("time.monotonic", return_value=expired):
+            response, queries = self.get_me()
+        self.assertEqual(response.json()["first_name"], "Другое")
+        self.assertEqual(queries, first)
+
+    def test_cached_user_save_keeps_other_fields(self):
+        self.get_me()
+        avatar = "images/avatars/fresh.png"
+        User.objects.filter(pk=self.user.pk).update(avatar=avatar)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                "/api/users/set_password/",
+                {
+                    "current_password": "password1",
+                    "new_password": "Another-password-2",
+                },
+            )
+        self.assertEqual(response.status_code, 204)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.avatar.name, avatar)
+        self.assertTrue(self.user.check_password("Another-password-2"))
+
+
+class ConditionalGetTests(QueryBudgetTestCase):
+    recipes_count = 2
+
+    def get(self, url, **headers):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, headers=headers)
+        return response, len(context.captured_queries)
+
+    def test_not_modified_before_serialization(self):
+        response, _ = self.get("/api/recipes/")
+        response, queries = self.get(
+            "/api/recipes/", if_none_match=response["ETag"],
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(queries, 1)
+
+    def test_etag_changes_with_user_state(self):
+        self.client.force_authenticate(self.user)
+        recipe = Recipe.objects.first()
+        url = f"/api/recipes/{recipe.id}/"
+        etag = self.get(url)[0]["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f"/api/recipes/{recipe.id}/favorite/")
+        response, _ = self.get(url, if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()["is_favorited"])
+
+    def test_etag_changes_with_table_version(self):
+        etag = self.get("/api/tags/")[0]["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(name="Новый", slug="new")
+        response, _ = self.get("/api/tags/", if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), len(self.tags) + 1)
+
+    def test_only_author_card_changes_reset_recipe_pages(self):
+        etag = self.get("/api/recipes/")[0]["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post("/api/users/", {
+                "email": "new@example.com",
+                "username": "newcomer",
+                "first_name": "Имя",
+                "last_name": "Фамилия",
+                "password": "Strong-password-1",
+            })
+            self.user.first_name = "Читатель"
+            self.user.save()
+        response, _ = self.get("/api/recipes/", if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+
+        author = Recipe.objects.first().author
+        with self.captureOnCommitCallbacks(execute=True):
+            author.first_name = "Автор"
+            author.save()
+        response, _ = self.get("/api/recipes/", if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        names = [
+            recipe["author"]["first_name"]
+            for recipe in response.json()["results"]
+        ]
+        self.assertIn("Автор", names)
+
+    def test_page_with_stale_count_is_not_cached(self):
+        cache.clear()
+        stale = [(Recipe._meta.label_lower, -1)]
+        with mock.patch.object(
+            CachedCountPagination, "get_count_versions", return_value=stale,
+        ):
+            self.client.get("/api/recipes/")
+        self.assertFalse([key for key in cache._cache if "page:" in key])
+        self.client.get("/api/recipes/")
+        self.assertTrue([key for key in cache._cache if "page:" in key])
+
+
+class RecipeSearchTests(QueryBudgetTestCase):
+    recipes_count = 2
+
+    def test_search_ranks_name_matches_first(self):
+        author = self.authors[0]
+        in_text = Recipe.objects.create(
+            author=author,
+            name="Суп",
+            image="images/recipes/test.png",
+            text="Густой борщ со сметаной",
+            cooking_time=60,
+        )
+        in_name = Recipe.objects.create(
+            author=author,
+            name="Борщ",
+            image="images/recipes/test.png",
+            text="Классический рецепт",
+            cooking_time=90,
+        )
+        response = self.client.get("/api/recipes/?search=борщ")
+        self.assertEqual(
+            [recipe["id"] for recipe in response.json()["results"]],
+            [in_name.id, in_text.id],
+        )
+
+    def test_search_keeps_rank_in_cursor_mode(self):
+        in_name = Recipe.objects.create(
+            author=self.authors[1],
+            name="Борщ",
+            image="images/recipes/test.png",
+            text="Классический рецепт",
+            cooking_time=90,
+        )
+        in_text = Recipe.objects.create(
+            author=self.authors[0],
+            name="Суп",
+            image="images/recipes/test.png",
+            text="Почти борщ",
+            cooking_time=60,
+        )
+        response = self.client.get(
+            "/api/recipes/?search=борщ&pagination=cursor",
+        )
+        self.assertEqual(
+            [recipe["id"] for recipe in response.json()["results"]],
+            [in_name.id, in_text.id],
+        )
+        self.assertIn("count", response.json())
+
+    def test_search_follows_writes_outside_save(self):
+        updated, loaded = Recipe.objects.order_by("id")
+        Recipe.objects.filter(pk=updated.pk).update(name="Окрошка")
+        # Фикстуры не содержат поискового вектора, как при loaddata
+        fixture = json.loads(serializers.serialize(
+            "json",
+            [loaded],
+            fields=[
+                "author",
+                "name",
+                "image",
+                "image_variants",
+                "text",
+                "cooking_time",
+                "created",
+            ],
+        ))
+        fixture[0]["fields"]["name"] = "Солянка"
+        for obj in serializers.deserialize("json", json.dumps(fixture)):
+            obj.save()
+        for query, recipe in (("окрошка", updated), ("солянка", loaded)):
+            response = self.client.get(f"/api/recipes/?search={query}")
+            self.assertEqual(
+                [found["id"] for found in response.json()["results"]],
+                [recipe.id],
+            )
+
+    def test_search_combines_with_filters(self):
+        author = self.authors[1]
+        Recipe.objects.create(
+            author=author,
+            name="Омлет",
+            image="images/recipes/test.png",
+            text="Яйца и молоко",
+            cooking_time=10,
+        )
+        response = self.client.get(
+            f"/api/recipes/?search=омлет&author={self.authors[0].id}",
+        )
+        self.assertEqual(response.json()["count"], 0)
+        response = self.client.get(
+            f"/api/recipes/?search=омлет&author={author.id}",
+        )
+        self.assertEqual(response.json()["count"], 1)
+
+
+class IngredientAutocompleteTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit="г")
+            for name in ["Сыр", "сырники", "Плавленый сыр", "Масло", "Брынза"]
+        )
+
+    def setUp(self):
+        ingredient_index.index = None
+        ingredient_index.checked = None
+
+    def test_prefix_matches_first(self):
+        response = self.client.get("/api/ingredients/?name=сыр")
+        self.assertEqual(
+            [item["name"] for item in response.json()],
+            ["Сыр", "сырники", "Плавленый сыр"],
+        )
+
+    def test_warm_index_does_not_query_database(self):
+        self.client.get("/api/ingredients/?name=м")
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get("/api/ingredients/?name=л")
+        self.assertEqual(len(context.captured_queries), 0)
+        self.assertEqual(
+            [item["name"] for item in response.json()],
+            ["Масло", "Плавленый сыр"],
+        )
+
+    def test_full_list_snapshot(self):
+        response = self.client.get(
+            "/api/ingredients/", headers={"accept-encoding": "gzip, br"},
+        )
+        self.assertEqual(response["Content-Encoding"], "br")
+        self.assertEqual(
+            [item["name"] for item in json.loads(
+                brotli.decompress(response.content),
+            )],
+            ["Брынза", "Масло", "Плавленый сыр", "Сыр", "сырники"],
+        )
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(
+                "/api/ingredients/",
+                headers={
+                    "accept-encoding": "gzip",
+                    "if-none-match": response["ETag"].replace("-br", "-gzip"),
+                },
+            )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(context.captured_queries), 0)
+
+
+class ShoppingListTests(QueryBudgetTestCase):
+    recipes_count = 4
+
+    def add_to_cart(self, *recipes):
+        Cart.objects.bulk_create(
+            Cart(user=self.user, recipe=recipe) for recipe in recipes
+        )
+        ShoppingListItem.add_recipes(
+            self.user.pk, [recipe.pk for recipe in recipes],
+        )
+
+    def test_same_ingredient_is_merged(self):
+        recipes = list(Recipe.objects.all())
+        self.add_to_cart(*recipes)
+        expected = {}
+        for item in RecipeIngredient.objects.select_related("ingredient"):
+            name = item.ingredient.name
+            expected[name] = expected.get(name, 0) + item.amount
+        with CaptureQueriesContext(connection) as context:
+            rows = list(get_shopping_list(self.user))
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertEqual(
+            rows,
+            [
+                {"name": name, "measurement_unit": "г", "amount": amount}
+                for name, amount in sorted(expected.items())
+            ],
+        )
+
+    def test_download_pdf(self):
+        self.add_to_cart(Recipe.objects.first())
+        self.client.force_authenticate(self.user)
+        response = self.client.get("/api/recipes/download_shopping_cart/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/pdf")
+
+    def test_repeat_download_uses_cached_pdf(self):
+        cache.clear()
+        self.add_to_cart(Recipe.objects.first())
+        self.client.force_authenticate(self.user)
+        first = self.client.get("/api/recipes/download_shopping_cart/")
+        with mock.patch("api.shopping_list.render_pdf") as render_pdf:
+            second = self.client.get("/api/recipes/download_shopping_cart/")
+        render_pdf.assert_not_called()
+        self.assertEqual(
+            b"".join(first.streaming_content),
+            b"".join(second.streaming_content),
+        )
+
+    def test_streaming_formats(self):
+        self.add_to_cart(Recipe.objects.first())
+        rows = list(get_shopping_list(self.user))
+        self.client.force_authenticate(self.user)
+        url = "/api/recipes/download_shopping_cart/"
+
+        response = self.client.get(url, {"format": "json"})
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertEqual(
+            json.loads(b"".join(response.streaming_content)), rows,
+        )
+
+        response = self.client.get(url, {"format": "csv"})
+        self.assertIn("attachment", response["Content-Disposition"])
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "name,measurement_unit,amount")
+        self.assertEqual(len(lines), len(rows) + 1)
+
+        response = self.client.get(url, {"format": "txt"})
+        text = b"".join(response.streaming_content).decode()
+        self.assertIn(f'- {rows[0]["name"]}: {rows[0]["amount"]} г', text)
+
+        response = self.client.get(url, {"format": "xml"})
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(SHOPPING_LIST_ASYNC=True)
+    def test_async_pdf_job(self):
+        cache.clear()
+        self.add_to_cart(Recipe.objects.first())
+        self.client.force_authenticate(self.user)
+        response = self.client.get(
+            "/api/recipes/download_shopping_cart/", {"async": "1"},
+        )
+        self.assertEqual(response.status_code, 202)
+        url = response["Location"]
+        self.assertEqual(self.client.get(url).json()["status"], "pending")
+
+        (job,) = claim_jobs(2)
+        self.assertEqual(claim_jobs(2), [])
+        complete_job(job, render_pdf(job.payload))
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/pdf")
+
+        other = User.objects.exclude(pk=self.user.pk).first()
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_incremental_updates_match_rebuild(self):
+        recipe, other = Recipe.objects.order_by("pk")[:2]
+        self.client.force_authenticate(self.user)
+        for item in (recipe, other):
+            self.client.post(f"/api/recipes/{item.pk}/shopping_cart/")
+        self.assertEqual(ShoppingListItem.rebuild(dry_run=True), 0)
+
+        self.client.force_authenticate(recipe.author)
+        response = self.client.patch(
+            f"/api/recipes/{recipe.pk}/",
+            {
+                "name": recipe.name,
+                "text": recipe.text,
+                "cooking_time": recipe.cooking_time,
+                "tags": [self.tags[0].pk],
+                "ingredients": [
+                    {"id": self.ingredients[0].pk, "amount": 7},
+                    {"id": self.ingredients[1].pk, "amount": 3},
+                ],
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(ShoppingListItem.rebuild(dry_run=True), 0)
+
+        self.client.force_authenticate(self.user)
+        self.client.delete(f"/api/recipes/{other.pk}/shopping_cart/")
+        self.assertEqual(ShoppingListItem.rebuild(dry_run=True), 0)
+
+        self.client.force_authenticate(recipe.author)
+        self.client.delete(f"/api/recipes/{recipe.pk}/")
+        self.assertEqual(ShoppingListItem.rebuild(dry_run=True), 0)
+        self.assertFalse(ShoppingListItem.objects.exists())
+
+    def test_writes_outside_api_match_rebuild(self):
+        # Так пишет админка: по одному объекту и удалением QuerySet
+        recipe, other, third = Recipe.objects.order_by("pk")[:3]
+        cart = Cart.objects.create(user=self.user, recipe=recipe)
+        Cart.objects.create(user=self.user, recipe=third)
+        self.assertEqual(ShoppingListItem.rebuild(dry_run=True), 0)
+        cart.recipe = other
+        cart.save()
+        self.assertEqual(ShoppingListItem.rebuild(dry_run=True), 0)
+
+        item = RecipeIngredient.objects.filter(recipe=other).first()
+        item.amount += 5
+        item.save()
+        self.assertEqual(ShoppingListItem.rebuild(dry_run=True), 0)
+        RecipeIngredient.objects.create(
+            recipe=other, ingredient=self.ingredients[-1], amount=4,
+        )
+        item.delete()
+        self.assertEqual(ShoppingListItem.rebuild(dry_run=True), 0)
+
+        cart.delete()
+        self.assertEqual(ShoppingListItem.rebuild(dry_run=True), 0)
+        Cart.objects.filter(user=self.user).delete()
+        self.assertEqual(ShoppingListItem.rebuild(dry_run=True), 0)
+        self.assertFalse(ShoppingListItem.objects.exists())
+
+    def test_summary(self):
+        self.add_to_cart(*Recipe.objects.all())
+        self.client.force_authenticate(self.user)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get("/api/recipes/shopping_cart/")
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertEqual(
+            [(item["name"], item["amount"]) for item in response.json()],
+            [(row["name"], row["amount"])
+             for row in get_shopping_list(self.user)],
+        )
+        self.assertTrue(all(
+            item["recipe_count"] == 2 for item in response.json()
+        ))
+
+    def test_bulk_cart(self):
+        recipe, other = Recipe.objects.order_by("pk")[:2]
+        self.add_to_cart(recipe)
+        self.client.force_authenticate(self.user)
+        url = "/api/recipes/shopping_cart/"
+
+        response = self.client.post(
+            url, {"recipes": [recipe.pk, other.pk, 0]}, format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            url, {"recipes": [recipe.pk, other.pk, 999999]}, format="json",
+        )
+        self.assertEqual(
+            [item["status"] for item in response.json()],
+            ["exists", "created", "not_found"],
+        )
+        self.assertEqual(Cart.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(ShoppingListItem.rebuild(dry_run=True), 0)
+
+        response = self.client.delete(
+            url, {"recipes": [other.pk, other.pk, 999999]}, format="json",
+        )
+        self.assertEqual(
+            response.json(),
+            [
+                {"id": other.pk, "status": "deleted"},
+                {"id": 999999, "status": "not_found"},
+            ],
+        )
+        response = self.client.delete(
+            url, {"recipes": [other.pk]}, format="json",
+        )
+        self.assertEqual(response.json()[0]["status"], "missing")
+        self.assertEqual(ShoppingListItem.rebuild(dry_run=True), 0)
+
+    def test_bulk_favorite(self):
+        recipe_ids = list(Recipe.objects.values_list("pk", flat=True))
+        self.client.force_authenticate(self.user)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(
+                "/api/recipes/favorite/", {"recipes": recipe_ids},
+                format="json",
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(context.captured_queries), 6)
+        self.assertEqual(
+            Favorite.objects.filter(user=self.user).count(), len(recipe_ids),
+        )
+
+
+class RecipeWriteTests(QueryBudgetTestCase):
+    recipes_count = 1
+
+    def patch_recipe(self, ingredient_ids):
+        recipe = Recipe.objects.get()
+        self.client.force_authenticate(recipe.author)
+        return self.client.patch(
+            f"/api/recipes/{recipe.pk}/",
+            {
+                "name": recipe.name,
+                "text": recipe.text,
+                "cooking_time": recipe.cooking_time,
+                "tags": [self.tags[0].pk],
+                "ingredients": [
+                    {"id": ingredient_id, "amount": 1}
+                    for ingredient_id in ingredient_ids
+                ],
+            },
+            format="json",
+        )
+
+    def test_new_recipe_is_listed(self):
+        cache.clear()
+        author = Recipe.objects.get().author
+        url = f"/api/recipes/?author={author.pk}"
+        self.assertEqual(self.client.get(url).json()["count"], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            Recipe.objects.create(
+                author=author,
+                name="Новый рецепт",
+                image="images/recipes/test.png",
+                text="Описание",
+                cooking_time=5,
+            )
+        response = self.client.get(url).json()
+        self.assertEqual(response["count"], 2)
+        self.assertEqual(len(response["results"]), 2)
+
+    def test_unknown_ingredients_reported_together(self):
+        response = self.patch_recipe(
+            [self.ingredients[0].pk, 100500, 100501],
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("100500, 100501", str(response.json()))
+
+    def test_ingredient_validation_is_one_query(self):
+        ids = [ingredient.pk for ingredient in self.ingredients]
+        counts = []
+        for size in (2, len(ids)):
+            with CaptureQueriesContext(connection) as context:
+                response = self.patch_recipe(ids[:size])
+            self.assertEqual(response.status_code, 200)
+            counts.append(sum(
+                'FROM "recipe_ingredient"' in query["sql"]
+                for query in context.captured_queries
+            ))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_unchanged_relations_are_not_rewritten(self):
+        recipe = Recipe.objects.get()
+        recipe.tags.set([self.tags[0]])
+        recipe.recipe_ingredients.update(amount=1)
+        rows = list(recipe.recipe_ingredients.values_list("pk", flat=True))
+        ids = list(recipe.recipe_ingredients.values_list(
+            "ingredient_id", flat=True,
+        ))
+        with CaptureQueriesContext(connection) as context:
+            response = self.patch_recipe(ids)
+        self.assertEqual(response.status_code, 200)
+        writes = [
+            query["sql"] for query in context.captured_queries
+            if ("recipeingredient" in query["sql"]
+                or "recipe_tags" in query["sql"])
+            and not query["sql"].startswith("SELECT")
+        ]
+        self.assertEqual(writes, [])
+        self.assertEqual(
+            list(recipe.recipe_ingredients.values_list("pk", flat=True)),
+            rows,
+        )
+
+    def test_changed_ingredients_are_diffed(self):
+        recipe = Recipe.objects.get()
+        kept, removed = recipe.recipe_ingredients.order_by("pk")[:2]
+        response = self.patch_recipe([kept.ingredient_id])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            list(recipe.recipe_ingredients.values_list("pk", "amount")),
+            [(kept.pk, 1)],
+        )
+
+
+class RelationWriteTests(QueryBudgetTestCase):
+    recipes_count = 1
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+
+    def test_favorite_twice(self):
+        recipe = Recipe.objects.get()
+        url = f"/api/recipes/{recipe.pk}/favorite/"
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(url)
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(any(
+            "favorite" in query["sql"] and query["sql"].startswith("SELECT")
+            for query in context.captured_queries
+        ))
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Favorite.objects.filter(user=self.user).count(), 1)
+
+    def test_cart_twice(self):
+        recipe = Recipe.objects.get()
+        url = f"/api/recipes/{recipe.pk}/shopping_cart/"
+        self.assertEqual(self.client.post(url).status_code, 201)
+        self.assertEqual(self.client.post(url).status_code, 400)
+        self.assertEqual(ShoppingListItem.rebuild(dry_run=True), 0)
+
+    def test_subscribe_twice(self):
+        url = f"/api/users/{self.authors[1].pk}/subscribe/"
+        self.assertEqual(self.client.post(url).status_code, 201)
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("author", response.json())
+        response = self.client.post(f"/api/users/{self.user.pk}/subscribe/")
+        self.assertEqual(response.status_code, 400)
+
+
+def make_png(size=(2, 2)):
+    buffer = io.BytesIO()
+    Image.new("RGB", size).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ImageUploadTests(QueryBudgetTestCase):
+    recipes_count = 1
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+
+    def test_avatar_raw_body(self):
+        uploads = []
+        close = TemporaryUploadedFile.close
+
+        def spy(file):
+            uploads.append(file.temporary_file_path())
+            return close(file)
+
+        with mock.patch.object(TemporaryUploadedFile, "close", spy):
+            response = self.client.put(
+                "/api/users/me/avatar/", make_png(), content_type="image/png",
+            )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.avatar.name.endswith(".png"))
+        self.assertTrue(uploads)
+        self.assertFalse(any(os.path.exists(path) for path in uploads))
+
+    def test_avatar_multipart(self):
+        upload = SimpleUploadedFile("a.png", make_png(), "image/png")
+        response = self.client.put(
+            "/api/users/me/avatar/", {"avatar": upload}, format="multipart",
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+
+    def test_avatar_base64(self):
+        data = base64.b64encode(make_png()).decode()
+        response = self.client.put(
+            "/api/users/me/avatar/",
+            {"avatar": f"data:image/png;base64,{data}"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+
+    def test_oversized_dimensions_rejected(self):
+        response = self.client.put(
+            "/api/users/me/avatar/",
+            make_png((constants.MAX_IMAGE_SIDE + 1, 1)),
+            content_type="image/png",
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_recipe_multipart_create(self):
+        response = self.client.post(
+            "/api/recipes/",
+            {
+                "name": "Рецепт",
+                "text": "Описание",
+                "cooking_time": 5,
+                "tags": [self.tags[0].pk],
+                "ingredients[0]id": self.ingredients[0].pk,
+                "ingredients[0]amount": 2,
+                "image": SimpleUploadedFile("r.png", make_png(), "image/png"),
+            },
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+
+    def test_recipe_image_raw_body(self):
+        recipe = Recipe.objects.get()
+        self.client.force_authenticate(recipe.author)
+        response = self.client.put(
+            f"/api/recipes/{recipe.pk}/image/",
+            make_png(),
+            content_type="image/png",
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.client.force_authenticate(self.user)
+        response = self.client.put(
+            f"/api/recipes/{recipe.pk}/image/",
+            make_png(),
+            content_type="image/png",
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_image_variants(self):
+        recipe = Recipe.objects.get()
+        self.client.force_authenticate(recipe.author)
+        self.client.put(
+            f"/api/recipes/{recipe.pk}/image/",
+            make_png((800, 400)),
+            content_type="image/png",
+        )
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image_variants, {})
+
+        with ThreadPoolExecutor(1) as pool:
+            ImageVariantsCommand(stdout=io.StringIO()).process(
+                pool, 10, Recipe, "image", "image_variants",
+            )
+        recipe.refresh_from_db()
+        self.assertEqual(
+            sorted(recipe.image_variants["jpeg"]), ["320", "640"],
+        )
+        with recipe.image.storage.open(
+            recipe.image_variants["webp"]["320"],
+        ) as file:
+            self.assertEqual(Image.open(file).size, (320, 160))
+
+        response = self.client.get(f"/api/recipes/{recipe.pk}/")
+        self.assertTrue(
+            response.json()["image_variants"]["webp"]["640"].startswith(
+                "http://testserver/media/",
+            ),
+        )
+
+        self.client.put(
+            f"/api/recipes/{recipe.pk}/image/",
+            make_png(),
+            content_type="image/png",
+        )
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image_variants, {})
+
+    def test_same_avatar_is_stored_once(self):
+        other = User.objects.exclude(pk=self.user.pk).first()
+        for user in (self.user, other):
+            self.client.force_authenticate(user)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.put(
+                    "/api/users/me/avatar/",
+                    make_png(),
+                    content_type="image/png",
+                )
+            user.refresh_from_db()
+        name = self.user.avatar.name
+        self.assertEqual(other.avatar.name, name)
+        self.assertEqual(MediaFile.objects.get(name=name).refcount, 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete("/api/users/me/avatar/")
+        self.assertTrue(other.avatar.storage.exists(name))
+        self.assertEqual(MediaFile.objects.get(name=name).refcount, 1)
+
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete("/api/users/me/avatar/")
+        self.assertFalse(other.avatar.storage.exists(name))
+        self.assertFalse(MediaFile.objects.filter(name=name).exists())
+
+    def test_saving_same_bytes_survives_pending_delete(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(
+                "/api/users/me/avatar/", make_png(), content_type="image/png",
+            )
+        self.user.refresh_from_db()
+        name = self.user.avatar.name
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.delete("/api/users/me/avatar/")
+
+        # Те же байты сохраняются, пока удаление файла ещё не выполнено.
+        self.assertEqual(
+            content_storage.save("avatar.png", ContentFile(make_png())), name,
+        )
+        for callback in callbacks:
+            callback()
+        self.assertTrue(content_storage.exists(name))
+        self.assertEqual(MediaFile.objects.get(name=name).refcount, 1)
+
+    def test_migrate_to_content_storage_resets_variants(self):
+        recipe = Recipe.objects.get()
+        old = default_storage.save(
+            "images/recipes/old.png", ContentFile(make_png()),
+        )
+        Recipe.objects.filter(pk=recipe.pk).update(
+            image=old,
+            image_variants={"jpeg": {"320": "images/recipes/variants/x.jpg"}},
+        )
+        call_command(
+            "migrate_media_to_cas",
+            keep_originals=True,
+            stdout=io.StringIO(),
+            stderr=io.StringIO(),
+        )
+        recipe.refresh_from_db()
+        self.assertTrue(is_content_addressed(recipe.image.name))
+        self.assertEqual(recipe.image_variants, {})
+
+    def test_collect_orphaned_media(self):
+        self.client.put(
+            "/api/users/me/avatar/", make_png(), content_type="image/png",
+        )
+        self.user.refresh_from_db()
+        variant = get_variant_name(self.user.avatar.name, 320, "jpeg")
+        self.user.avatar_variants = {"jpeg": {"320": variant}}
+        self.user.save(update_fields=["avatar_variants"])
+        # Копия прежнего изображения рецепта, на которую ещё ссылается поле
+        old_variant = get_variant_name("images/recipes/old.png", 40, "webp")
+        Recipe.objects.update(image_variants={"webp": {"40": old_variant}})
+        orphan_variant = get_variant_name(self.user.avatar.name, 640, "jpeg")
+        for name in (
+            variant, old_variant, orphan_variant, "images/old/b.png",
+        ):
+            default_storage.save(name, io.BytesIO(b"data"))
+
+        options = {"min_age": 0, "stdout": io.StringIO()}
+        call_command("collect_orphaned_media", dry_run=True, **options)
+        self.assertTrue(default_storage.exists("images/old/b.png"))
+
+        quarantine = tempfile.mkdtemp()
+        call_command(
+            "collect_orphaned_media", quarantine=quarantine, **options,
+        )
+        self.assertFalse(default_storage.exists("images/old/b.png"))
+        self.assertFalse(default_storage.exists(orphan_variant))
+        self.assertTrue(default_storage.exists(variant))
+        self.assertTrue(default_storage.exists(old_variant))
+        self.assertTrue(default_storage.exists(self.user.avatar.name))
+        with open(f"{quarantine}/images/old/b.png", "rb") as file:
+            self.assertEqual(file.read(), b"data")
@@ -31,6 +31,18 @@ urlpatterns = [
         views.ShoppingCartViewSet.as_view({"get": "download"}),
         name="download_shopping_cart",
     ),
+    path(
+        "recipes/download_shopping_cart/<int:pk>/",
+        views.ShoppingCartViewSet.as_view({"get": "job"}),
+        name="shopping_list_job",
+    ),
+    path(
+        "recipes/shopping_cart/",
+        views.ShoppingCartViewSet.as_view(
+            {"get": "summary", "post": "bulk", "delete": "bulk"},
+        ),
+        name="shopping_cart_summary",
+    ),
     path("", include(router.urls)),
     path("auth/token/login/", TokenCreateView.as_view(), name="login"),
     path("auth/token/logout/", TokenDestroyView.as_view(), name="logout"),
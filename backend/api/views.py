@@ -1,21 +1,38 @@
 ﻿import io
-import pathlib
 from http import HTTPStatus
 
-from django.db import IntegrityError
-from django.db.models import Count, Exists, OuterRef
-from django.http import FileResponse, HttpResponse, JsonResponse
+from django.conf import settings
+from django.db import transaction
+from django.db.models import (
+    BooleanField,
+    Count,
+    Exists,
+    F,
+    OuterRef,
+    Prefetch,
+    Value,
+    Window,
+)
+from django.db.models.functions import RowNumber
+from django.http import (
+    FileResponse,
+    HttpResponse,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
+from django.utils.http import content_disposition_header
 from django_filters.rest_framework import DjangoFilterBackend
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.decorators import action
 from rest_framework.filters import OrderingFilter
+from rest_framework.parsers import JSONParser, MultiPartParser
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.viewsets import (
@@ -24,15 +41,28 @@ from rest_framework.viewsets import (
     ViewSet,
 )
 
-from api.filters import IngredientFilter, RecipeFilter
-from api.paginator import PagePagination
+from api.authentication import CachedTokenAuthentication
+from api.conditional import ConditionalGetMixin
+from api.filters import (
+    IngredientFilter,
+    RecipeFilter,
+    RecipeSearchFilter,
+)
+from api.ingredient_index import ingredient_index
+from api.page_cache import SharedPageCacheMixin
+from api.paginator import (
+    CachedCountPagination,
+    RecipeCursorPagination,
+    SubscriptionPagination,
+)
+from api.parsers import RawImageParser, RawUploadCleanupMixin
 from api.permissions import IsAuthorOrReadOnly
 from api.serializers import (
     AvatarSerializer,
-    CartSerializer,
-    FavoriteSerializer,
     IngredientSingleSerializer,
     RecipeCreateUpdateSerializer,
+    RecipeIdsSerializer,
+    RecipeImageSerializer,
     RecipeSerializer,
     ShortRecipeSerializer,
     SubscribtionSerializer,
@@ -40,14 +70,28 @@ from api.serializers import (
     UserSerializer,
     UserWithRecipesSerializer,
     UserWriteSerializer,
+    get_subscribed_author_ids,
+)
+from api.shopping_list import (
+    STREAM_FORMATS,
+    get_cached_pdf,
+    get_shopping_list,
+    get_shopping_list_pdf,
+    get_shopping_list_summary,
+    iter_shopping_list,
 )
+from app import constants
 from recipe.models import (
     Cart,
     Favorite,
     Ingredient,
     Recipe,
     RecipeIngredient,
+    ShoppingListItem,
+    ShoppingListJob,
+    TableVersion,
     Tag,
+    insert_ignoring_conflicts,
 )
 from users.models import Subscribtion, User
 
@@ -60,80 +104,115 @@ class ShoppingCartViewSet(ViewSet):
         return handle_user_recipe_relation(
             request,
             pk,
-            CartSerializer,
             Cart,
             "Рецепт уже в корзине",
             "Рецепт не в корзине",
         )
 
+    @action(detail=False, methods=["post", "delete"])
+    def bulk(self, request):
+        """Добавить/удалить несколько рецептов из корзины."""
+        return handle_bulk_user_recipe_relation(request, Cart)
+
     @action(detail=False, methods=["get"])
-    def download(self, request):
-        cart = Cart.objects.filter(user=request.user).values_list(
-            "recipe_id", flat=True,
-        )
+    def summary(self, request):
+        """Текущий список покупок без сборки файла."""
+        return Response(list(get_shopping_list_summary(request.user)))
 
-        ingredients = RecipeIngredient.objects.filter(
-            recipe_id__in=cart,
-        ).select_related("ingredient", "recipe")
-
-        cart_ingredients = {}
-        for ingredient in ingredients:
-            cart_ingredient = cart_ingredients.pop(
-                ingredient.id,
-                {
-                    "name": ingredient.ingredient.name,
-                    "measurement_unit": ingredient.ingredient.measurement_unit,
-                    "amount": 0,
-                },
-            )
-            cart_ingredient["amount"] += ingredient.amount
-            cart_ingredients[ingredient.id] = cart_ingredient
+    @action(detail=False, methods=["get"])
+    def download(self, request):
+        """Список покупок в PDF или потоково в txt, csv и json.
 
-        pdf = self.gen_pdf(cart_ingredients.values())
+        Формат выбирается параметром ``format``, по умолчанию PDF.
+        """
+        export_format = request.query_params.get("format", "pdf")
         now = timezone.now()
-        filename = f'cart-{now.strftime("%d-%m-%Y-%H-%M")}.pdf'
-
-        return FileResponse(pdf, as_attachment=True, filename=filename)
-
-    def gen_pdf(self, ingredients):
-        buffer = io.BytesIO()
-        doc = SimpleDocTemplate(buffer)
+        filename = f'cart-{now.strftime("%d-%m-%Y-%H-%M")}.{export_format}'
+
+        if export_format == "pdf":
+            ingredients = list(get_shopping_list(request.user))
+            if self.is_async(request) and get_cached_pdf(ingredients) is None:
+                return self.enqueue(request, ingredients)
+            pdf = get_shopping_list_pdf(ingredients)
+            return FileResponse(
+                io.BytesIO(pdf), as_attachment=True, filename=filename,
+            )
 
-        font_path = pathlib.Path("static", "fonts", "DejaVuSans.ttf")
-        pdfmetrics.registerFont(TTFont("DejaVuSans", font_path))
+        if export_format not in STREAM_FORMATS:
+            return Response(
+                {"error": "Неподдерживаемый формат списка покупок"},
+                status=HTTPStatus.BAD_REQUEST,
+            )
+        stream, content_type, as_attachment = STREAM_FORMATS[export_format]
+        response = StreamingHttpResponse(
+            stream(iter_shopping_list(request.user)),
+            content_type=content_type,
+        )
+        if as_attachment:
+            response["Content-Disposition"] = content_disposition_header(
+                as_attachment, filename,
+            )
+        return response
 
-        styles = getSampleStyleSheet()
-        style = styles["Normal"]
-        style.fontName = "DejaVuSans"
+    @action(detail=True, methods=["get"])
+    def job(self, request, pk=None):
+        """Статус фоновой сборки PDF или готовый файл."""
+        job = get_object_or_404(
+            ShoppingListJob.objects.defer("payload"),
+            pk=pk,
+            user=request.user,
+        )
+        if job.status == ShoppingListJob.Status.DONE:
+            filename = f'cart-{job.created.strftime("%d-%m-%Y-%H-%M")}.pdf'
+            return FileResponse(
+                io.BytesIO(job.result), as_attachment=True, filename=filename,
+            )
 
-        elements = []
-        elements.append(Paragraph("Список ингредиентов:", style))
-        elements.append(Spacer(1, 10))
+        data = {"id": job.pk, "status": job.status}
+        if job.status == ShoppingListJob.Status.FAILED:
+            data["error"] = "Не удалось собрать список покупок"
+            return Response(data)
+        return Response(
+            data,
+            status=HTTPStatus.ACCEPTED,
+            headers={
+                "Retry-After": str(constants.SHOPPING_LIST_JOB_RETRY_AFTER),
+            },
+        )
 
-        for i, ingredient in enumerate(ingredients):
-            if i == len(ingredients) - 1:
-                line = (
-                    f'- {ingredient["name"]}: {ingredient["amount"]} '
-                    f'{ingredient["measurement_unit"]}.'
-                )
-                elements.append(Paragraph(line, style))
-            else:
-                line = (
-                    f'- {ingredient["name"]}: {ingredient["amount"]} '
-                    f'{ingredient["measurement_unit"]};'
-                )
-                elements.append(Paragraph(line, style))
-                elements.append(Spacer(1, 6))
+    @staticmethod
+    def is_async(request):
+        return settings.SHOPPING_LIST_ASYNC and (
+            request.query_params.get("async") in ("1", "true")
+        )
 
-        doc.build(elements)
-        buffer.seek(0)
+    def enqueue(self, request, ingredients):
+        job = ShoppingListJob.objects.create(
+            user=request.user, payload=ingredients,
+        )
+        url = reverse("shopping_list_job", args=[job.pk])
+        return Response(
+            {
+                "id": job.pk,
+                "status": job.status,
+                "url": request.build_absolute_uri(url),
+            },
+            status=HTTPStatus.ACCEPTED,
+            headers={
+                "Location": url,
+                "Retry-After": str(constants.SHOPPING_LIST_JOB_RETRY_AFTER),
+            },
+        )
 
-        return buffer
+    def perform_content_negotiation(self, request, force=False):
+        # Параметр format выбирает формат файла, а не рендерер DRF.
+        return super().perform_content_negotiation(request, force=True)
 
 
-class IngredientViewSet(ReadOnlyModelViewSet):
+class IngredientViewSet(ConditionalGetMixin, ReadOnlyModelViewSet):
     """ViewSet для ингредиентов. Поддерживает list и retrieve."""
 
+    versioned_models = (Ingredient,)
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSingleSerializer
     permission_classes = [AllowAny]
@@ -145,6 +224,34 @@ class IngredientViewSet(ReadOnlyModelViewSet):
     ordering_fields = ["name"]
     ordering = ["name"]
 
+    def list(self, request, *args, **kwargs):
+        """Список и поиск по названию отдаются из памяти процесса."""
+        name = request.query_params.get("name")
+        if name:
+            return Response(ingredient_index.get().search(name))
+        if not request.query_params:
+            return self.snapshot_response(request)
+        return super().list(request, *args, **kwargs)
+
+    def snapshot_response(self, request):
+        """Полный список из готового сжатого снимка со строгим ETag."""
+        snapshot = ingredient_index.get_snapshot()
+        encoding = snapshot.negotiate(
+            request.headers.get("Accept-Encoding", ""),
+        )
+        etag = snapshot.get_etag(encoding)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = HttpResponse(
+                snapshot.bodies[encoding], content_type="application/json",
+            )
+            if encoding != "identity":
+                response["Content-Encoding"] = encoding
+        response["ETag"] = etag
+        patch_vary_headers(response, ["Accept-Encoding"])
+        patch_cache_control(response, no_cache=True)
+        return response
+
 
 class ShortLinkViewSet(ViewSet):
     """ViewSet для генерации и перехода по коротким ссылкам рецептов."""
@@ -170,40 +277,155 @@ class ShortLinkViewSet(ViewSet):
         return redirect(f"/recipes/{recipe_id}")
 
 
-class RecipeViewSet(ModelViewSet):
-    authentication_classes = [TokenAuthentication]
+class RecipeViewSet(
+    RawUploadCleanupMixin,
+    ConditionalGetMixin,
+    SharedPageCacheMixin,
+    ModelViewSet,
+):
+    versioned_models = (Recipe, Tag, Ingredient)
+    user_dependent = True
+    page_cache_bypass_params = ("is_favorited", "is_in_shopping_cart")
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [AllowAny]
     serializer_class = RecipeSerializer
-    pagination_class = PagePagination
-    filter_backends = [DjangoFilterBackend, OrderingFilter]
+    pagination_class = CachedCountPagination
+    filter_backends = [
+        DjangoFilterBackend,
+        OrderingFilter,
+        RecipeSearchFilter,
+    ]
     filterset_class = RecipeFilter
     ordering_fields = ["id", "name", "cooking_time"]
-    ordering = ["-created"]
+    ordering = ["-created", "id"]
+
+    @property
+    def paginator(self):
+        """Курсорная пагинация по запросу клиента, иначе постраничная.
+
+        Курсор требует порядка (-created, id), поэтому с ?search= он
+        игнорируется: результаты поиска отдаются постранично по
+        релевантности.
+        """
+        if not hasattr(self, "_paginator"):
+            searching = self.request.query_params.get(
+                RecipeSearchFilter.search_param, "",
+            ).strip()
+            if not searching and RecipeCursorPagination.is_requested(
+                self.request,
+            ):
+                self._paginator = RecipeCursorPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    def get_requested_fields(self):
+        """Поля ответа с учётом параметров ?fields= и ?omit=.
+
+        Поле id остаётся всегда: по нему накладывается состояние
+        пользователя.
+        """
+        fields = RecipeSerializer.Meta.fields
+        if self.action not in ["list", "retrieve"]:
+            return fields
+
+        params = self.request.query_params
+        if params.get("fields"):
+            requested = {name.strip() for name in params["fields"].split(",")}
+            requested.add("id")
+            fields = [name for name in fields if name in requested]
+        if params.get("omit"):
+            omitted = {name.strip() for name in params["omit"].split(",")}
+            omitted.discard("id")
+            fields = [name for name in fields if name not in omitted]
+        return fields
 
     def get_queryset(self):
-        user = self.request.user
-
-        qs = Recipe.objects.select_related("author").prefetch_related(
-            "tags", "ingredients", "recipe_ingredients__ingredient",
-        )
-
-        if user.is_authenticated:
-            qs = qs.annotate(
-                is_favorited=Exists(
-                    Favorite.objects.filter(user=user, recipe=OuterRef("pk")),
-                ),
-                is_in_shopping_cart=Exists(
-                    Cart.objects.filter(user=user, recipe=OuterRef("pk")),
+        fields = self.get_requested_fields()
+
+        qs = Recipe.objects.all()
+        if "author" in fields:
+            qs = qs.select_related("author")
+        if "tags" in fields:
+            qs = qs.prefetch_related("tags")
+        if "ingredients" in fields:
+            qs = qs.prefetch_related(
+                Prefetch(
+                    "recipe_ingredients",
+                    queryset=RecipeIngredient.objects.select_related(
+                        "ingredient",
+                    ),
                 ),
             )
-        else:
-            qs = qs.annotate(
-                is_favorited=Exists(Favorite.objects.none()),
-                is_in_shopping_cart=Exists(Cart.objects.none()),
-            )
-
+        if self.action in ["list", "retrieve"]:
+            qs = qs.only(*self.get_columns(fields))
         return qs
 
+    def overlay_user_state(self, recipes):
+        """Проставляет избранное, корзину и подписки пользователя.
+
+        Избранное и корзина читаются одним запросом по id рецептов
+        страницы, подписки берутся из общего для запроса множества.
+        """
+        user = self.request.user
+        recipe_ids = [
+            recipe["id"] for recipe in recipes
+            if "is_favorited" in recipe or "is_in_shopping_cart" in recipe
+        ]
+        favorited, in_cart = set(), set()
+        if user.is_authenticated and recipe_ids:
+            relations = Favorite.objects.filter(
+                user=user, recipe_id__in=recipe_ids,
+            ).values_list("recipe_id", Value(True)).union(
+                Cart.objects.filter(
+                    user=user, recipe_id__in=recipe_ids,
+                ).values_list("recipe_id", Value(False)),
+                all=True,
+            )
+            for recipe_id, is_favorite in relations:
+                (favorited if is_favorite else in_cart).add(recipe_id)
+        subscribed = frozenset()
+        if any("author" in recipe for recipe in recipes):
+            subscribed = get_subscribed_author_ids(self.request)
+
+        for recipe in recipes:
+            if "is_favorited" in recipe:
+                recipe["is_favorited"] = recipe["id"] in favorited
+            if "is_in_shopping_cart" in recipe:
+                recipe["is_in_shopping_cart"] = recipe["id"] in in_cart
+            if "author" in recipe:
+                author = recipe["author"]
+                author["is_subscribed"] = author["id"] in subscribed
+
+    def get_columns(self, fields):
+        """Колонки рецепта и автора, нужные для выбранных полей."""
+        columns = ["id", "created"]
+        columns += [
+            name for name in fields
+            if name in [
+                "name", "image", "image_variants", "text", "cooking_time",
+            ]
+        ]
+        if "author" in fields:
+            columns += [
+                f"author__{name}" for name in UserSerializer.Meta.fields
+                if name != "is_subscribed"
+            ]
+        return columns
+
+    def get_serializer(self, *args, **kwargs):
+        if self.action in ["list", "retrieve"]:
+            kwargs.setdefault("fields", self.get_requested_fields())
+        return super().get_serializer(*args, **kwargs)
+
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        TableVersion.bump(Recipe._meta.label_lower)
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        TableVersion.bump(Recipe._meta.label_lower)
+
     def get_permissions(self):
         """Определение прав доступа в зависимости от действия."""
         if self.action in ["create", "update", "partial_update", "destroy"]:
@@ -214,8 +436,23 @@ class RecipeViewSet(ModelViewSet):
         """Выбор сериализатора в зависимости от действия."""
         if self.action in ["create", "update", "partial_update"]:
             return RecipeCreateUpdateSerializer
+        if self.action == "image":
+            return RecipeImageSerializer
         return RecipeSerializer
 
+    @action(
+        detail=True,
+        methods=["put"],
+        permission_classes=[IsAuthenticated, IsAuthorOrReadOnly],
+        parser_classes=[RawImageParser, MultiPartParser, JSONParser],
+    )
+    def image(self, request, pk=None):
+        """Замена изображения рецепта телом запроса, файлом или base64."""
+        serializer = self.get_serializer(self.get_object(), data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_update(serializer)
+        return Response(serializer.data, status=HTTPStatus.OK)
+
     @action(
         detail=True,
         methods=["post", "delete"],
@@ -227,19 +464,41 @@ class RecipeViewSet(ModelViewSet):
         return handle_user_recipe_relation(
             request,
             pk,
-            FavoriteSerializer,
             Favorite,
             "Рецепт уже в избранном",
             "Рецепт не в избранном",
         )
 
+    @action(
+        detail=False,
+        methods=["post", "delete"],
+        url_path="favorite",
+        permission_classes=[IsAuthenticated],
+    )
+    def bulk_favorite(self, request):
+        """Добавить/удалить несколько рецептов из избранного."""
+        return handle_bulk_user_recipe_relation(request, Favorite)
+
 
-class UserViewSet(ModelViewSet):
+class UserViewSet(RawUploadCleanupMixin, ModelViewSet):
     queryset = User.objects.all()
     permission_classes = [AllowAny]
-    authentication_classes = [TokenAuthentication]
-    pagination_class = PagePagination
+    authentication_classes = [CachedTokenAuthentication]
+    pagination_class = CachedCountPagination
     serializer_class = UserSerializer
+    upload_field = "avatar"
+
+    def get_queryset(self):
+        user = self.request.user
+        if not user.is_authenticated:
+            return self.queryset.annotate(
+                is_subscribed=Value(False, output_field=BooleanField()),
+            )
+        return self.queryset.annotate(
+            is_subscribed=Exists(
+                Subscribtion.objects.filter(user=user, author=OuterRef("pk")),
+            ),
+        )
 
     def get_serializer_class(self):
         """Возвращает сериализатор в зависимости от действия."""
@@ -258,7 +517,33 @@ class UserViewSet(ModelViewSet):
             ).values_list(
                 "author_id", flat=True,
             ),
-        ).annotate(recipes_count=Count("recipes"))
+        ).annotate(
+            recipes_count=Count("recipes"),
+            is_subscribed=Value(True, output_field=BooleanField()),
+        ).prefetch_related(
+            Prefetch("recipes", queryset=self.get_short_recipes()),
+        )
+
+    def get_short_recipes(self):
+        """Рецепты авторов для карточки подписки.
+
+        Загружаются только поля ``ShortRecipeSerializer``, а при
+        ``recipes_limit`` - не больше заданного числа последних рецептов
+        каждого автора: лишние строки отсекает оконная функция в базе.
+        """
+        recipes = Recipe.objects.only(
+            "author_id", *ShortRecipeSerializer.Meta.fields,
+        ).order_by("-created", "id")
+        limit = self.request.query_params.get("recipes_limit", "")
+        if not limit.isdigit():
+            return recipes
+        return recipes.annotate(
+            row_number=Window(
+                RowNumber(),
+                partition_by=F("author"),
+                order_by=["-created", "id"],
+            ),
+        ).filter(row_number__lte=int(limit))
 
     @action(
         detail=False,
@@ -314,7 +599,7 @@ class UserViewSet(ModelViewSet):
     )
     def subscriptions(self, request):
         qs = self.get_subscriptions_queryset()
-        paginator = self.pagination_class()
+        paginator = SubscriptionPagination()
         page = paginator.paginate_queryset(qs, request)
         serializer = self.get_serializer(
             page, many=True, context={"request": request},
@@ -326,6 +611,7 @@ class UserViewSet(ModelViewSet):
         methods=["put", "delete"],
         permission_classes=[IsAuthenticated],
         url_path="me/avatar",
+        parser_classes=[JSONParser, MultiPartParser, RawImageParser],
     )
     def avatar(self, request):
         user = request.user
@@ -346,7 +632,8 @@ class UserViewSet(ModelViewSet):
             return Response(status=HTTPStatus.NO_CONTENT)
 
 
-class TagViewSet(ReadOnlyModelViewSet):
+class TagViewSet(ConditionalGetMixin, ReadOnlyModelViewSet):
+    versioned_models = (Tag,)
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
@@ -357,7 +644,6 @@ class TagViewSet(ReadOnlyModelViewSet):
 def handle_user_recipe_relation(
     request,
     recipe_id,
-    serializer_class,
     model_class,
     already_exists_msg="Рецепт уже добавлен",
     not_in_relation_msg="Рецепт не в списке",
@@ -365,13 +651,10 @@ def handle_user_recipe_relation(
     recipe = get_object_or_404(Recipe, id=recipe_id)
 
     if request.method == "POST":
-        try:
-            serializer = serializer_class(
-                data={"user": request.user.id, "recipe": recipe_id},
-            )
-            serializer.is_valid(raise_exception=True)
-            serializer.save()
-        except IntegrityError:
+        created = add_user_recipe_relations(
+            request.user, model_class, [recipe.id],
+        )
+        if not created:
             return JsonResponse(
                 {"field_name": [already_exists_msg]},
                 status=HTTPStatus.BAD_REQUEST,
@@ -390,3 +673,77 @@ def handle_user_recipe_relation(
                 {"error": not_in_relation_msg}, status=HTTPStatus.BAD_REQUEST,
             )
         return HttpResponse(status=HTTPStatus.NO_CONTENT)
+
+
+def add_user_recipe_relations(user, model_class, recipe_ids):
+    """Добавляет рецепты в избранное или корзину одним INSERT.
+
+    Возвращает id рецептов, которых там ещё не было. Вставка обходит
+    сигналы, поэтому версия состояния пользователя и список покупок
+    обновляются здесь. Транзакция нужна только корзине: её вставка и
+    изменение списка покупок должны зафиксироваться вместе.
+    """
+    rows = [
+        {"user": user.pk, "recipe": recipe_id} for recipe_id in recipe_ids
+    ]
+    if model_class is Cart:
+        with transaction.atomic():
+            created = insert_ignoring_conflicts(Cart, rows, "recipe")
+            if created:
+                ShoppingListItem.add_recipes(user.pk, created)
+    else:
+        created = insert_ignoring_conflicts(model_class, rows, "recipe")
+    if created:
+        TableVersion.bump(TableVersion.user_state(user.pk))
+    return created
+
+
+def handle_bulk_user_recipe_relation(request, model_class):
+    """Добавляет или удаляет сразу список рецептов.
+
+    Новые связи вставляются одним INSERT без предварительного чтения,
+    удаляемые удаляются одним запросом по списку id. Для каждого id
+    возвращается статус: created, exists, deleted, missing или not_found.
+    """
+    serializer = RecipeIdsSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    recipe_ids = list(dict.fromkeys(serializer.validated_data["recipes"]))
+    user = request.user
+    relations = model_class.objects.filter(
+        user=user, recipe_id__in=recipe_ids,
+    )
+
+    with transaction.atomic():
+        found = set(
+            Recipe.objects.filter(id__in=recipe_ids).values_list(
+                "id", flat=True,
+            ),
+        )
+        if request.method == "POST":
+            created = add_user_recipe_relations(
+                user,
+                model_class,
+                [recipe_id for recipe_id in recipe_ids if recipe_id in found],
+            )
+            statuses = {"created": set(created), "exists": found}
+        else:
+            related = set(
+                relations.select_for_update().values_list(
+                    "recipe_id", flat=True,
+                ),
+            )
+            if related:
+                relations.delete()
+            statuses = {"deleted": related, "missing": found}
+
+    results = []
+    for recipe_id in recipe_ids:
+        status = next(
+            (
+                status for status, ids in statuses.items()
+                if recipe_id in ids
+            ),
+            "not_found",
+        )
+        results.append({"id": recipe_id, "status": status})
+    return Response(results, status=HTTPStatus.OK)
@@ -4,6 +4,54 @@ PAGINATE_COUNT = 10
 # Maximum number of objects on page
 MAX_PAGE_SIZE = 100
 
+# Lifetime of cached page counts, seconds
+COUNT_CACHE_TIMEOUT = 30
+
+# Lifetime of cached list pages, seconds
+PAGE_CACHE_TIMEOUT = 300
+
+# Minimum planner row estimate to use instead of an exact COUNT(*)
+APPROXIMATE_COUNT_THRESHOLD = 100_000
+
+# How often a worker checks the ingredient table version, seconds
+INGREDIENT_INDEX_REFRESH_INTERVAL = 30
+
+# Lifetime of cached shopping-list PDFs, seconds
+PDF_CACHE_TIMEOUT = 60 * 60
+
+# Rows fetched per database round trip when streaming a shopping list
+SHOPPING_LIST_CHUNK_SIZE = 500
+
+# Seconds after which a running shopping-list job is handed out again
+SHOPPING_LIST_JOB_TIMEOUT = 5 * 60
+
+# Seconds a finished shopping-list job is kept for polling
+SHOPPING_LIST_JOB_TTL = 60 * 60
+
+# Client poll interval suggested in Retry-After, seconds
+SHOPPING_LIST_JOB_RETRY_AFTER = 2
+
+# Cached token lookups per worker and their lifetime, seconds: checked
+# against the shared cache on every hit, or trusted as is without it
+TOKEN_CACHE_SIZE = 10_000
+TOKEN_CACHE_TIMEOUT = 60
+TOKEN_CACHE_LOCAL_TIMEOUT = 5
+
+# Maximum number of recipes in one bulk favorite or cart request
+MAX_BULK_RECIPES = 100
+
+# Limits for uploaded images, checked before the image is decoded
+MAX_IMAGE_SIZE = 10 * 1024 * 1024
+MAX_IMAGE_SIDE = 10_000
+MAX_IMAGE_PIXELS = 40_000_000
+
+# Widths of image copies for list cards and their encoding quality
+IMAGE_VARIANT_WIDTHS = (320, 640)
+IMAGE_VARIANT_QUALITY = 80
+
+# PostgreSQL text search configuration for recipes
+SEARCH_CONFIG = "russian"
+
 # Maximum length of model fields
 MAX_INGREDIENT_NAME_LENGTH = 100
 MAX_MEASUREMENT_UNIT_LENGTH = 100
@@ -15,3 +63,6 @@ MAX_EMAIL_LENGTH = 254
 MAX_FIRST_NAME_LENGTH = 150
 MAX_LAST_NAME_LENGTH = 150
 MAX_PASSWORD_LENGTH = 254
+MAX_TABLE_VERSION_NAME_LENGTH = 64
+MAX_JOB_STATUS_LENGTH = 16
+MAX_MEDIA_FILE_NAME_LENGTH = 255
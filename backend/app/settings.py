@@ -62,7 +62,7 @@ TEMPLATES = [
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework.authentication.TokenAuthentication",
+        "api.authentication.CachedTokenAuthentication",
     ],
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticated",
@@ -89,6 +89,31 @@ DATABASES = {
     },
 }
 
+if getenv("DJANGO_USE_SQLITE", "False") == "True":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": BASE_DIR / "db.sqlite3",
+        },
+    }
+
+CACHES = {
+    "default": {
+        "BACKEND": getenv(
+            "DJANGO_CACHE_BACKEND",
+            "django.core.cache.backends.locmem.LocMemCache",
+        ),
+        "LOCATION": getenv("DJANGO_CACHE_LOCATION", ""),
+    },
+}
+
+# Кеш Django общий для всех процессов: токены в кеше процесса сверяются
+# с ним, иначе живут без проверки TOKEN_CACHE_LOCAL_TIMEOUT секунд
+TOKEN_CACHE_SHARED = getenv("DJANGO_TOKEN_CACHE_SHARED", "False") == "True"
+
+# Сборка PDF списка покупок в фоновом обработчике по запросу с ?async=1
+SHOPPING_LIST_ASYNC = getenv("DJANGO_SHOPPING_LIST_ASYNC", "False") == "True"
+
 AUTH_USER_MODEL = "users.User"
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -125,3 +150,8 @@ MEDIA_ROOT = BASE_DIR / "media"
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 DATA_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024
+
+# Загружаемые файлы сразу пишутся во временный файл, а не в память
+FILE_UPLOAD_HANDLERS = [
+    "django.core.files.uploadhandler.TemporaryFileUploadHandler",
+]
@@ -5,6 +5,8 @@ set -e
 python manage.py migrate
 python manage.py collectstatic --no-input
 python manage.py loaddata fixtures/tags.json fixtures/ingredients.json fixtures/users.json fixtures/recipes.json fixtures/recipe_ingredients.json fixtures/subscriptions.json fixtures/favorites.json
+# Фикстуры ссылаются на старые имена файлов, исходники нужны при перезапуске
+python manage.py migrate_media_to_cas --keep-originals
 
 # Передаём управление команде из CMD
 exec "$@"
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipe.models import ShoppingListItem
+
+
+class Command(BaseCommand):
+    help = "Сверка и пересборка списков покупок"  # noqa: VNE003
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run", action="store_true",
+            help="Только сверить, не пересобирая таблицу",
+        )
+
+    def handle(self, *args, dry_run, **kwargs):
+        mismatches = ShoppingListItem.rebuild(dry_run=dry_run)
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS("Списки покупок согласованы"))
+        elif dry_run:
+            raise CommandError(f"Расхождений в списках покупок: {mismatches}")
+        else:
+            self.stdout.write(self.style.WARNING(
+                f"Исправлено расхождений в списках покупок: {mismatches}"))
@@ -0,0 +1,205 @@
+import json
+import os
+import posixpath
+import shutil
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Q, TextField
+from django.db.models.functions import Cast
+
+from recipe.models import IMAGE_FIELDS, MediaFile
+
+
+class Command(BaseCommand):
+    help = "Удаление медиафайлов, на которые нет ссылок"  # noqa: VNE003
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run", action="store_true",
+            help="Только показать файлы без ссылок",
+        )
+        parser.add_argument(
+            "--quarantine",
+            help="Переносить файлы в этот каталог вместо удаления",
+        )
+        parser.add_argument(
+            "--root", default="images",
+            help="Проверяемый каталог внутри MEDIA_ROOT",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=500,
+            help="Файлов, проверяемых одним набором запросов",
+        )
+        parser.add_argument(
+            "--min-age", type=int, default=60 * 60,
+            help="Не трогать файлы моложе стольких секунд",
+        )
+        parser.add_argument(
+            "--limit", type=int,
+            help="Проверить не больше стольких файлов за запуск",
+        )
+        parser.add_argument(
+            "--start-after",
+            help="Продолжить обход после этого файла",
+        )
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.media_root = os.path.realpath(settings.MEDIA_ROOT)
+        root = os.path.join(self.media_root, options["root"])
+        if not os.path.isdir(root):
+            raise CommandError(f"Каталог не найден: {root}")
+        quarantine = options["quarantine"]
+        if quarantine and os.path.realpath(quarantine).startswith(
+            os.path.realpath(root) + os.sep,
+        ):
+            raise CommandError("Карантин не может быть внутри проверяемого")
+
+        self.kept = self.get_fixture_names()
+        self.scanned = self.orphaned = self.freed = 0
+        cutoff = time.time() - options["min_age"]
+        start_after = options["start_after"]
+        start = tuple(start_after.split("/")) if start_after else ()
+
+        batch = []
+        last = None
+        for name, entry in self.scan(root, options["root"], start):
+            if options["limit"] and self.scanned >= options["limit"]:
+                break
+            self.scanned += 1
+            last = name
+            stat = entry.stat(follow_symlinks=False)
+            if stat.st_mtime > cutoff:
+                continue
+            batch.append((name, entry.path, stat.st_size))
+            if len(batch) >= options["batch_size"]:
+                self.process(batch, last)
+                batch = []
+        if batch:
+            self.process(batch, last)
+
+        action = "найдено" if options["dry_run"] else "обработано"
+        self.stdout.write(self.style.SUCCESS(
+            f"Проверено файлов: {self.scanned}, без ссылок {action}: "
+            f"{self.orphaned}, {self.freed} байт"))
+        if last is not None:
+            self.stdout.write(f"Последний файл: {last}")
+
+    def scan(self, path, name, start):
+        """Обходит каталог в порядке имён, не раскрывая лишние каталоги.
+
+        Имена сравниваются по частям пути, поэтому порядок совпадает с
+        порядком обхода, и ``--start-after`` пропускает уже проверенные
+        каталоги целиком.
+        """
+        with os.scandir(path) as entries:
+            entries = sorted(entries, key=lambda entry: entry.name)
+        for entry in entries:
+            entry_name = f"{name}/{entry.name}"
+            parts = tuple(entry_name.split("/"))
+            if entry.is_dir(follow_symlinks=False):
+                if parts < start[:len(parts)]:
+                    continue
+                yield from self.scan(entry.path, entry_name, start)
+            elif entry.is_file(follow_symlinks=False) and parts > start:
+                yield entry_name, entry
+
+    def process(self, batch, last):
+        names = [name for name, _, _ in batch]
+        referenced = self.kept.intersection(names)
+        referenced |= self.get_referenced_variants(names)
+        for model, (field, _) in IMAGE_FIELDS.items():
+            referenced.update(
+                model.objects.filter(**{f"{field}__in": names}).values_list(
+                    field, flat=True,
+                ),
+            )
+        referenced.update(
+            MediaFile.objects.filter(
+                name__in=names, refcount__gt=0,
+            ).values_list("name", flat=True),
+        )
+
+        orphans = [
+            (name, path, size) for name, path, size in batch
+            if name not in referenced
+        ]
+        for name, path, size in orphans:
+            if self.options["dry_run"]:
+                self.stdout.write(f"  {name}")
+            elif self.options["quarantine"]:
+                target = os.path.join(self.options["quarantine"], name)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.move(path, target)
+            else:
+                os.remove(path)
+        if orphans and not self.options["dry_run"]:
+            MediaFile.objects.filter(
+                name__in=[name for name, _, _ in orphans],
+            ).delete()
+
+        self.orphaned += len(orphans)
+        self.freed += sum(size for _, _, size in orphans)
+        self.stdout.write(
+            f"Проверено {self.scanned}, без ссылок {self.orphaned}, "
+            f"{self.freed} байт, последний файл {last}",
+        )
+
+    @staticmethod
+    def get_referenced_variants(names):
+        """Уменьшенные копии из ``names``, перечисленные в полях копий.
+
+        Владелец копии не угадывается по имени файла: после смены
+        изображения поле копий может ссылаться на копии прежнего имени.
+        На PostgreSQL имя ищется вхождением ``{формат: {ширина: имя}}``
+        в jsonb, на остальных базах - в тексте JSON.
+        """
+        candidates = {}
+        for name in names:
+            directory, filename = posixpath.split(name)
+            stem, extension = posixpath.splitext(filename)
+            _, separator, width = stem.rpartition("-")
+            if posixpath.basename(directory) == "variants" and separator:
+                candidates[name] = (extension[1:], width)
+        if not candidates:
+            return set()
+
+        referenced = set()
+        for model, (_, variants_field) in IMAGE_FIELDS.items():
+            rows = model.objects.all()
+            condition = Q()
+            if connections[rows.db].vendor == "postgresql":
+                for name, (format, width) in candidates.items():
+                    condition |= Q(**{
+                        f"{variants_field}__contains": {format: {width: name}},
+                    })
+            else:
+                rows = rows.annotate(
+                    variants_text=Cast(variants_field, TextField()),
+                )
+                for name in candidates:
+                    condition |= Q(variants_text__contains=json.dumps(name))
+            for variants in rows.filter(condition).values_list(
+                variants_field, flat=True,
+            ):
+                for widths in variants.values():
+                    if isinstance(widths, dict):
+                        referenced.update(widths.values())
+        return referenced.intersection(names)
+
+    @staticmethod
+    def get_fixture_names():
+        """Файлы из фикстур: они загружаются заново при каждом запуске."""
+        names = set()
+        fixtures = settings.BASE_DIR / "fixtures"
+        for path in fixtures.glob("*.json"):
+            with open(path, encoding="utf-8") as file:
+                for item in json.load(file):
+                    fields = item.get("fields", {})
+                    for field, _ in IMAGE_FIELDS.values():
+                        if fields.get(field):
+                            names.add(fields[field])
+        return names
@@ -2,13 +2,15 @@ import json
 import pathlib
 
 from django.core.management.base import BaseCommand
+from django.db import transaction
 
-from recipe.models import Ingredient
+from recipe.models import Ingredient, TableVersion
 
 
 class Command(BaseCommand):
     help = "Загрузка ингредиентов"  # noqa: VNE003
 
+    @transaction.atomic
     def handle(self, *args, **kwargs):
         Ingredient.objects.all().delete()
 
@@ -22,6 +24,7 @@ class Command(BaseCommand):
 
         ingredients = [Ingredient(**item) for item in data]
         Ingredient.objects.bulk_create(ingredients, ignore_conflicts=True)
+        TableVersion.bump(Ingredient._meta.label_lower)
 
         self.stdout.write(self.style.SUCCESS(
             f"Загружено {len(ingredients)} ингредиентов"))
@@ -0,0 +1,61 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+
+from recipe.models import (
+    IMAGE_FIELDS,
+    MediaFile,
+    TableVersion,
+    get_image_version_names,
+)
+from recipe.storage import content_storage, is_content_addressed
+
+
+class Command(BaseCommand):
+    help = "Перенос изображений в хранилище по содержимому"  # noqa: VNE003
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--keep-originals", action="store_true",
+            help="Не удалять перенесённые исходные файлы",
+        )
+
+    def handle(self, *args, keep_originals, **kwargs):
+        moved = set()
+        for model, (field, variants_field) in IMAGE_FIELDS.items():
+            rows = model.objects.exclude(**{field: ""}).values_list(
+                "pk", field,
+            )
+            updated = []
+            for pk, name in rows.iterator():
+                if is_content_addressed(name):
+                    continue
+                if not content_storage.exists(name):
+                    self.stderr.write(f"Файл не найден: {name}")
+                    continue
+                with content_storage.open(name) as file:
+                    content_name = content_storage.save(name, file)
+                # Копии старого имени пересоздаст make_image_variants
+                model.objects.filter(pk=pk, **{field: name}).update(
+                    **{field: content_name, variants_field: {}},
+                )
+                moved.add(name)
+                updated.append(pk)
+            TableVersion.bump_now(*get_image_version_names(model, updated))
+
+        references = Counter()
+        for model, (field, _) in IMAGE_FIELDS.items():
+            references.update(
+                model.objects.exclude(**{field: ""}).values_list(
+                    field, flat=True,
+                ),
+            )
+        MediaFile.rebuild(references)
+
+        if not keep_originals:
+            for name in moved - set(references):
+                content_storage.delete(name)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Перенесено файлов: {len(moved)}, "
+            f"уникальных файлов: {len(references)}"))
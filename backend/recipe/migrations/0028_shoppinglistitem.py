@@ -0,0 +1,57 @@
+# Generated by Django 5.2.6 on 2026-10-18 17:32
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_shopping_list_items(apps, schema_editor):
+    Cart = apps.get_model('recipe', 'Cart')
+    ShoppingListItem = apps.get_model('recipe', 'ShoppingListItem')
+    rows = (
+        Cart.objects.filter(recipe__recipe_ingredients__isnull=False)
+        .values_list('user_id', 'recipe__recipe_ingredients__ingredient_id')
+        .annotate(
+            total_amount=models.Sum('recipe__recipe_ingredients__amount'),
+            recipe_count=models.Count('recipe_id', distinct=True),
+        )
+        .order_by()
+    )
+    ShoppingListItem.objects.bulk_create(
+        ShoppingListItem(
+            user_id=user_id,
+            ingredient_id=ingredient_id,
+            total_amount=total_amount,
+            recipe_count=recipe_count,
+        )
+        for user_id, ingredient_id, total_amount, recipe_count in rows
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0027_shoppinglistjob'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingListItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_amount', models.PositiveIntegerField(default=0, verbose_name='Общее количество')),
+                ('recipe_count', models.PositiveIntegerField(default=0, verbose_name='Количество рецептов')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_list_items', to='recipe.ingredient', verbose_name='Ингредиент')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_list_items', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Строка списка покупок',
+                'verbose_name_plural': 'Строки списков покупок',
+                'constraints': [models.UniqueConstraint(fields=('user', 'ingredient'), name='unique_shopping_list_item')],
+            },
+        ),
+        migrations.RunPython(
+            fill_shopping_list_items, migrations.RunPython.noop,
+        ),
+    ]
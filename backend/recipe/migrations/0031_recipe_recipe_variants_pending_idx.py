@@ -0,0 +1,19 @@
+# Generated by Django 5.2.6 on 2026-10-18 18:00
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0030_mediafile_alter_recipe_image'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(condition=models.Q(('image_variants', {}), models.Q(('image', ''), _negated=True)), fields=['id'], name='recipe_variants_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+from django.db import migrations
+
+from app import constants
+
+CREATE_TRIGGER = """
+CREATE FUNCTION recipe_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('{config}', COALESCE(NEW.name, '')), 'A')
+        || setweight(to_tsvector('{config}', COALESCE(NEW.text, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER recipe_search_vector_trigger
+BEFORE INSERT OR UPDATE OF name, text, search_vector ON {table}
+FOR EACH ROW EXECUTE FUNCTION recipe_search_vector_update();
+
+UPDATE {table} SET search_vector = NULL;
+"""
+
+DROP_TRIGGER = """
+DROP TRIGGER recipe_search_vector_trigger ON {table};
+DROP FUNCTION recipe_search_vector_update();
+"""
+
+
+def run_on_postgresql(sql):
+    """Выполняет SQL для таблицы рецептов только на PostgreSQL."""
+
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        table = schema_editor.quote_name(
+            apps.get_model('recipe', 'Recipe')._meta.db_table,
+        )
+        schema_editor.execute(
+            sql.format(config=constants.SEARCH_CONFIG, table=table),
+        )
+
+    return run
+
+
+class Migration(migrations.Migration):
+    """Поисковый вектор поддерживает триггер базы.
+
+    Так вектор верен после loaddata, QuerySet.update() и любых других
+    записей в обход Recipe.save().
+    """
+
+    dependencies = [
+        ('recipe', '0031_recipe_recipe_variants_pending_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_on_postgresql(CREATE_TRIGGER),
+            run_on_postgresql(DROP_TRIGGER),
+        ),
+    ]
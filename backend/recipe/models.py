@@ -1,8 +1,15 @@
+from functools import partial
+
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import connections, models, router, transaction
+from django.db.models import F
+from django.utils import timezone
 from slugify import slugify
 
 from app import constants
+from recipe.storage import content_storage, variants_pending
 from users.models import User
 
 
@@ -50,6 +57,13 @@ class Ingredient(models.Model):
         return f"{self.name} ({self.measurement_unit})"
 
 
+class RecipeManager(models.Manager):
+    """Не загружает поисковый вектор, если он не запрошен явно."""
+
+    def get_queryset(self):
+        return super().get_queryset().defer("search_vector")
+
+
 class Recipe(models.Model):
     author = models.ForeignKey(
         User,
@@ -63,8 +77,15 @@ class Recipe(models.Model):
     )
     image = models.ImageField(
         upload_to="images/recipes/",
+        storage=content_storage,
         verbose_name="Изображение",
     )
+    image_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name="Уменьшенные копии изображения",
+    )
     text = models.TextField(verbose_name="Описание")
     ingredients = models.ManyToManyField(
         Ingredient,
@@ -81,15 +102,68 @@ class Recipe(models.Model):
         auto_now_add=True,
         verbose_name="Дата создания",
     )
+    # На PostgreSQL вектор заполняет триггер базы (миграция 0032)
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        verbose_name="Поисковый вектор",
+    )
+
+    objects = RecipeManager()
 
     class Meta:
         verbose_name = "Рецепт"
         verbose_name_plural = "Рецепты"
+        indexes = [
+            models.Index(
+                fields=["-created", "id"], name="recipe_created_id_idx",
+            ),
+            GinIndex(fields=["search_vector"], name="recipe_search_idx"),
+            models.Index(
+                fields=["id"],
+                condition=variants_pending("image", "image_variants"),
+                name="recipe_variants_pending_idx",
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
 
+def insert_ignoring_conflicts(model, rows, returning="pk"):
+    """Вставляет строки одним запросом, пропуская уже существующие.
+
+    ``rows`` - словари значений по именам полей. Возвращает значения
+    поля ``returning`` только у вставленных строк, поэтому по ответу
+    видно, была ли связь создана или уже существовала. Конфликты
+    разрешает уникальное ограничение таблицы, так что одновременные
+    вставки одной связи не приводят к ошибке.
+    """
+    if not rows:
+        return []
+    connection = connections[router.db_for_write(model)]
+    quote = connection.ops.quote_name
+    fields = [model._meta.get_field(name) for name in rows[0]]
+    returning = model._meta.pk if returning == "pk" else (
+        model._meta.get_field(returning)
+    )
+    values = "({})".format(", ".join(["%s"] * len(fields)))
+    sql = (
+        f"INSERT INTO {quote(model._meta.db_table)} "
+        f"({', '.join(quote(field.column) for field in fields)}) "
+        f"VALUES {', '.join([values] * len(rows))} "
+        f"ON CONFLICT DO NOTHING RETURNING {quote(returning.column)}"
+    )
+    params = [
+        field.get_db_prep_save(row[field.name], connection)
+        for row in rows
+        for field in fields
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [value for value, in cursor.fetchall()]
+
+
 class UserRecipeRelation(models.Model):
     user = models.ForeignKey(
         User,
@@ -156,3 +230,426 @@ class RecipeIngredient(models.Model):
             f"{self.ingredient.name} "
             f"({self.amount} {self.ingredient.measurement_unit})"
         )
+
+
+class TableVersion(models.Model):
+    """Счётчик изменений таблицы или пользовательского состояния.
+
+    Используется для построения валидаторов HTTP-кеша (ETag,
+    Last-Modified) без чтения самих данных.
+    """
+
+    name = models.CharField(
+        max_length=constants.MAX_TABLE_VERSION_NAME_LENGTH,
+        unique=True,
+        verbose_name="Название",
+    )
+    version = models.PositiveBigIntegerField(
+        default=0,
+        verbose_name="Версия",
+    )
+    updated = models.DateTimeField(
+        default=timezone.now,
+        verbose_name="Дата изменения",
+    )
+
+    class Meta:
+        verbose_name = "Версия данных"
+        verbose_name_plural = "Версии данных"
+
+    def __str__(self):
+        return f"{self.name}: {self.version}"
+
+    @staticmethod
+    def user_state(user_id):
+        """Имя версии избранного, корзины и подписок пользователя."""
+        return f"user-state:{user_id}"
+
+    @classmethod
+    def bump(cls, *names):
+        """Увеличивает версии после фиксации текущей транзакции."""
+        transaction.on_commit(partial(cls.bump_now, *names))
+
+    @classmethod
+    def bump_now(cls, *names):
+        now = timezone.now()
+        for name in names:
+            updated = cls.objects.filter(name=name).update(
+                version=F("version") + 1, updated=now,
+            )
+            if not updated:
+                cls.objects.get_or_create(
+                    name=name, defaults={"version": 1, "updated": now},
+                )
+
+    @classmethod
+    def get_state(cls, *names):
+        """Версии в порядке ``names`` и время последнего изменения."""
+        rows = {
+            name: (version, updated)
+            for name, version, updated in cls.objects.filter(
+                name__in=names,
+            ).values_list("name", "version", "updated")
+        }
+        versions = tuple(rows.get(name, (0, None))[0] for name in names)
+        last_modified = max(
+            (updated for _, updated in rows.values()), default=None,
+        )
+        return versions, last_modified
+
+
+class ShoppingListJob(models.Model):
+    """Задание на сборку PDF списка покупок фоновым обработчиком.
+
+    Строки списка сохраняются на момент запроса, поэтому обработчику не
+    нужно обращаться к корзине, а результат не зависит от её изменений
+    после постановки в очередь.
+    """
+
+    class Status(models.TextChoices):
+        PENDING = "pending", "В очереди"
+        RUNNING = "running", "Выполняется"
+        DONE = "done", "Готово"
+        FAILED = "failed", "Ошибка"
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="shopping_list_jobs",
+        verbose_name="Пользователь",
+    )
+    status = models.CharField(
+        max_length=constants.MAX_JOB_STATUS_LENGTH,
+        choices=Status.choices,
+        default=Status.PENDING,
+        verbose_name="Статус",
+    )
+    payload = models.JSONField(verbose_name="Строки списка покупок")
+    result = models.BinaryField(null=True, verbose_name="PDF")
+    error = models.TextField(blank=True, verbose_name="Ошибка")
+    created = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name="Дата создания",
+    )
+    started = models.DateTimeField(null=True, verbose_name="Дата начала")
+    finished = models.DateTimeField(
+        null=True,
+        verbose_name="Дата завершения",
+    )
+
+    class Meta:
+        verbose_name = "Задание на список покупок"
+        verbose_name_plural = "Задания на списки покупок"
+        indexes = [
+            models.Index(
+                fields=["status", "created"],
+                name="shopping_list_job_queue_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username}: {self.status}"
+
+
+class ShoppingListItem(models.Model):
+    """Сумма ингредиента по всем рецептам в корзине пользователя.
+
+    Таблица поддерживается инкрементально при изменении корзины и
+    ингредиентов рецептов и пересобирается командой
+    ``check_shopping_lists``.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="shopping_list_items",
+        verbose_name="Пользователь",
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name="shopping_list_items",
+        verbose_name="Ингредиент",
+    )
+    total_amount = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Общее количество",
+    )
+    recipe_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Количество рецептов",
+    )
+
+    class Meta:
+        verbose_name = "Строка списка покупок"
+        verbose_name_plural = "Строки списков покупок"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "ingredient"],
+                name="unique_shopping_list_item",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id}: {self.ingredient_id} × {self.total_amount}"
+
+    @staticmethod
+    def aggregate(**filters):
+        """Суммы из корзин и рецептов по парам (пользователь, ингредиент).
+
+        ``filters`` применяются к ``Cart``; результат - словарь
+        ``{(user_id, ingredient_id): (total_amount, recipe_count)}``.
+        """
+        ingredients = "recipe__recipe_ingredients"
+        rows = (
+            Cart.objects.filter(
+                **filters, **{f"{ingredients}__isnull": False},
+            )
+            .values_list("user_id", f"{ingredients}__ingredient_id")
+            .annotate(
+                total_amount=models.Sum(f"{ingredients}__amount"),
+                recipe_count=models.Count("recipe_id", distinct=True),
+            )
+            .order_by()
+        )
+        return {
+            (user_id, ingredient_id): (total_amount, recipe_count)
+            for user_id, ingredient_id, total_amount, recipe_count in rows
+        }
+
+    @staticmethod
+    def get_amounts(recipe_id):
+        """Количество каждого ингредиента рецепта по ``ingredient_id``."""
+        return dict(
+            RecipeIngredient.objects.filter(recipe_id=recipe_id)
+            .values_list("ingredient_id")
+            .annotate(amount=models.Sum("amount"))
+            .order_by(),
+        )
+
+    @classmethod
+    def add_recipes(cls, user_id, recipe_ids, sign=1):
+        """Учитывает рецепты, добавленные в корзину пользователя."""
+        rows = (
+            RecipeIngredient.objects.filter(recipe_id__in=recipe_ids)
+            .values_list("ingredient_id")
+            .annotate(
+                total_amount=models.Sum("amount"),
+                recipe_count=models.Count("recipe_id", distinct=True),
+            )
+            .order_by()
+        )
+        cls.apply_deltas({
+            (user_id, ingredient_id): (
+                sign * total_amount, sign * recipe_count,
+            )
+            for ingredient_id, total_amount, recipe_count in rows
+        })
+
+    @classmethod
+    def remove_recipes(cls, user_id, recipe_ids):
+        """Учитывает рецепты, убранные из корзины пользователя."""
+        cls.add_recipes(user_id, recipe_ids, sign=-1)
+
+    @classmethod
+    def change_recipe(cls, recipe_id, old_amounts, new_amounts):
+        """Учитывает новые ингредиенты рецепта у всех, у кого он в корзине.
+
+        ``old_amounts`` и ``new_amounts`` - словари количества по
+        ``ingredient_id`` до и после изменения.
+        """
+        changes = {}
+        for ingredient_id in old_amounts.keys() | new_amounts.keys():
+            old = old_amounts.get(ingredient_id)
+            new = new_amounts.get(ingredient_id)
+            if old != new:
+                changes[ingredient_id] = (
+                    (new or 0) - (old or 0),
+                    (new is not None) - (old is not None),
+                )
+        if not changes:
+            return
+        user_ids = Cart.objects.filter(
+            recipe_id=recipe_id,
+        ).values_list("user_id", flat=True)
+        cls.apply_deltas({
+            (user_id, ingredient_id): delta
+            for user_id in user_ids
+            for ingredient_id, delta in changes.items()
+        })
+
+    @classmethod
+    @transaction.atomic
+    def apply_deltas(cls, deltas):
+        """Прибавляет ``{(user_id, ingredient_id): (amount, count)}``.
+
+        Недостающие строки сначала вставляются с нулями без конфликтов,
+        затем все нужные строки блокируются, поэтому параллельные
+        изменения одной корзины не теряются. Строки без рецептов
+        удаляются.
+        """
+        if not deltas:
+            return
+        cls.objects.bulk_create(
+            [
+                cls(user_id=user_id, ingredient_id=ingredient_id)
+                for user_id, ingredient_id in deltas
+            ],
+            ignore_conflicts=True,
+        )
+        user_ids = {user_id for user_id, _ in deltas}
+        ingredient_ids = {ingredient_id for _, ingredient_id in deltas}
+        items = [
+            item
+            for item in cls.objects.filter(
+                user_id__in=user_ids, ingredient_id__in=ingredient_ids,
+            ).order_by("pk").select_for_update()
+            if (item.user_id, item.ingredient_id) in deltas
+        ]
+        for item in items:
+            amount, count = deltas[item.user_id, item.ingredient_id]
+            item.total_amount = max(item.total_amount + amount, 0)
+            item.recipe_count = max(item.recipe_count + count, 0)
+        cls.objects.bulk_update(items, ["total_amount", "recipe_count"])
+        cls.objects.filter(
+            pk__in=[item.pk for item in items if item.recipe_count == 0],
+        ).delete()
+
+    @classmethod
+    @transaction.atomic
+    def rebuild(cls, dry_run=False):
+        """Сверяет таблицу с корзинами и пересобирает её при расхождениях.
+
+        Возвращает число несовпавших строк; при ``dry_run`` таблица не
+        меняется.
+        """
+        expected = cls.aggregate()
+        actual = {
+            (user_id, ingredient_id): (total_amount, recipe_count)
+            for user_id, ingredient_id, total_amount, recipe_count in (
+                cls.objects.select_for_update().values_list(
+                    "user_id", "ingredient_id", "total_amount", "recipe_count",
+                )
+            )
+        }
+        mismatches = sum(
+            expected.get(key) != actual.get(key)
+            for key in expected.keys() | actual.keys()
+        )
+        if mismatches and not dry_run:
+            cls.objects.all().delete()
+            cls.objects.bulk_create(
+                cls(
+                    user_id=user_id,
+                    ingredient_id=ingredient_id,
+                    total_amount=total_amount,
+                    recipe_count=recipe_count,
+                )
+                for (user_id, ingredient_id), (
+                    total_amount, recipe_count,
+                ) in expected.items()
+            )
+        return mismatches
+
+
+class MediaFile(models.Model):
+    """Число ссылок из моделей на файл в медиахранилище.
+
+    Файл удаляется из хранилища после фиксации транзакции, в которой
+    на него пропала последняя ссылка.
+    """
+
+    name = models.CharField(
+        max_length=constants.MAX_MEDIA_FILE_NAME_LENGTH,
+        unique=True,
+        verbose_name="Имя файла",
+    )
+    refcount = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Число ссылок",
+    )
+
+    class Meta:
+        verbose_name = "Медиафайл"
+        verbose_name_plural = "Медиафайлы"
+
+    def __str__(self):
+        return f"{self.name}: {self.refcount}"
+
+    @classmethod
+    def acquire(cls, name):
+        """Добавляет ссылку на файл.
+
+        Если строку как раз удаляет ``delete_unreferenced``, UPDATE
+        дождётся удаления и ничего не изменит, и строка создаётся заново.
+        """
+        if not name:
+            return
+        rows = cls.objects.filter(name=name)
+        while True:
+            if rows.update(refcount=F("refcount") + 1):
+                return
+            if insert_ignoring_conflicts(cls, [{"name": name, "refcount": 1}]):
+                return
+
+    @classmethod
+    def release(cls, name):
+        if not name:
+            return
+        cls.objects.filter(name=name, refcount__gt=0).update(
+            refcount=F("refcount") - 1,
+        )
+        transaction.on_commit(partial(cls.delete_unreferenced, name))
+
+    @classmethod
+    def delete_unreferenced(cls, name):
+        """Удаляет файл, на который не осталось ссылок.
+
+        Строка и файл удаляются в одной транзакции, поэтому новая ссылка
+        из ``acquire`` ждёт, пока файл не будет удалён, и хранилище после
+        неё записывает его заново.
+        """
+        with transaction.atomic():
+            deleted, _ = cls.objects.filter(name=name, refcount=0).delete()
+            if deleted:
+                content_storage.delete(name)
+
+    @classmethod
+    @transaction.atomic
+    def rebuild(cls, references):
+        """Пересчитывает ссылки по ``{имя файла: число ссылок}``."""
+        cls.objects.all().delete()
+        cls.objects.bulk_create(
+            cls(name=name, refcount=refcount)
+            for name, refcount in references.items()
+            if name
+        )
+
+
+# Поля изображений по моделям: поле файла и поле его уменьшенных копий
+IMAGE_FIELDS = {
+    Recipe: ("image", "image_variants"),
+    User: ("avatar", "avatar_variants"),
+}
+
+# Поля автора, которые показывает карточка рецепта
+AUTHOR_CARD_FIELDS = (
+    "email",
+    "username",
+    "first_name",
+    "last_name",
+    "avatar",
+    "avatar_variants",
+)
+
+
+def get_image_version_names(model, pks):
+    """Версии, которые сбрасывает смена изображений у строк ``pks``.
+
+    Аватар автора виден в карточке рецепта, поэтому при смене аватаров
+    авторов сбрасываются и страницы рецептов.
+    """
+    names = [model._meta.label_lower]
+    if model is User and Recipe.objects.filter(author_id__in=pks).exists():
+        names.append(Recipe._meta.label_lower)
+    return names
@@ -0,0 +1,263 @@
+from collections import defaultdict
+
+from django.db.models import Exists, OuterRef, QuerySet
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_init,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.dispatch import receiver
+
+from recipe.models import (
+    AUTHOR_CARD_FIELDS,
+    IMAGE_FIELDS,
+    Cart,
+    Favorite,
+    Ingredient,
+    MediaFile,
+    Recipe,
+    RecipeIngredient,
+    ShoppingListItem,
+    TableVersion,
+    Tag,
+)
+from users.models import Subscribtion, User
+
+VERSIONED_MODELS = {
+    Recipe: Recipe._meta.label_lower,
+    Tag: Tag._meta.label_lower,
+    Ingredient: Ingredient._meta.label_lower,
+    User: User._meta.label_lower,
+}
+
+USER_STATE_MODELS = (Favorite, Cart, Subscribtion)
+
+
+def bump_once(name, origin=None):
+    """Увеличивает версию один раз на исходный объект удаления.
+
+    При удалении QuerySet сигнал приходит для каждой строки, а версию
+    достаточно увеличить один раз.
+    """
+    if origin is not None:
+        bumped = origin.__dict__.setdefault("_bumped_table_versions", set())
+        if name in bumped:
+            return
+        bumped.add(name)
+    TableVersion.bump(name)
+
+
+def bump_table_version(sender, update_fields=None, origin=None, **kwargs):
+    """Отмечает изменение таблицы модели."""
+    if update_fields and set(update_fields) <= {"last_login"}:
+        return
+    bump_once(VERSIONED_MODELS[sender], origin)
+
+
+def bump_user_state(sender, instance, origin=None, **kwargs):
+    """Отмечает изменение избранного, корзины или подписок пользователя."""
+    bump_once(TableVersion.user_state(instance.user_id), origin)
+
+
+for model in VERSIONED_MODELS:
+    post_save.connect(bump_table_version, sender=model)
+    post_delete.connect(bump_table_version, sender=model)
+
+for model in USER_STATE_MODELS:
+    post_save.connect(bump_user_state, sender=model)
+    post_delete.connect(bump_user_state, sender=model)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def bump_recipe_tags(sender, action, **kwargs):
+    if action.startswith("post_"):
+        TableVersion.bump(Recipe._meta.label_lower)
+
+
+@receiver(pre_save, sender=User)
+def check_author_card(sender, instance, update_fields=None, raw=False,
+                      **kwargs):
+    """Отмечает, что автор рецептов изменил поля, видные в карточке.
+
+    Таблица пользователей в ключ страниц рецептов не входит, чтобы
+    регистрации и правки профилей без рецептов не сбрасывали кеш.
+    """
+    fields = set(AUTHOR_CARD_FIELDS)
+    if update_fields is not None:
+        fields &= set(update_fields)
+    if not fields or instance._state.adding and not raw:
+        return
+    stored = sender.objects.filter(
+        Exists(Recipe.objects.filter(author=OuterRef("pk"))),
+        pk=instance.pk,
+    ).values(*fields).first()
+    instance._author_card_changed = stored is not None and any(
+        stored[name] != sender._meta.get_field(name).get_prep_value(
+            getattr(instance, name),
+        )
+        for name in fields
+    )
+
+
+@receiver(post_save, sender=User)
+def bump_author_card(sender, instance, **kwargs):
+    if instance.__dict__.pop("_author_card_changed", False):
+        TableVersion.bump(Recipe._meta.label_lower)
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_recipe_from_shopping_lists(sender, instance, **kwargs):
+    """Вычитает удаляемый рецепт из списков покупок.
+
+    Строки корзины удаляются каскадом без пересчёта, поэтому рецепт
+    вычитается заранее, пока его ингредиенты ещё в базе.
+    """
+    ShoppingListItem.change_recipe(
+        instance.pk, ShoppingListItem.get_amounts(instance.pk), {},
+    )
+
+
+def is_deleted_directly(model, origin):
+    """Удаляют ли строки ``model`` сами, а не каскадом от другой модели."""
+    if isinstance(origin, QuerySet):
+        return origin.model is model
+    return isinstance(origin, model)
+
+
+@receiver(pre_save, sender=Cart)
+def remember_cart(sender, instance, **kwargs):
+    if instance.pk is not None:
+        instance._stored_cart = sender.objects.filter(
+            pk=instance.pk,
+        ).values_list("user_id", "recipe_id").first()
+
+
+@receiver(post_save, sender=Cart)
+def update_shopping_list(sender, instance, **kwargs):
+    """Учитывает строку корзины, сохранённую в обход API.
+
+    API добавляет строки одним INSERT без сигналов и обновляет список
+    покупок сам; здесь учитываются админка, loaddata и другой код.
+    """
+    stored = instance.__dict__.pop("_stored_cart", None)
+    current = (instance.user_id, instance.recipe_id)
+    if stored == current:
+        return
+    if stored is not None:
+        ShoppingListItem.remove_recipes(stored[0], [stored[1]])
+    ShoppingListItem.add_recipes(current[0], [current[1]])
+
+
+@receiver(pre_delete, sender=Cart)
+def remove_cart_from_shopping_list(sender, instance, origin=None, **kwargs):
+    """Вычитает удаляемые строки корзины из списков покупок.
+
+    При удалении QuerySet строки вычитаются разом при первом сигнале.
+    Каскадное удаление рецепта учтено выше, а строки списка покупок
+    удалённого пользователя удаляются вместе с ним.
+    """
+    if not is_deleted_directly(Cart, origin):
+        return
+    if isinstance(origin, Cart):
+        ShoppingListItem.remove_recipes(instance.user_id, [instance.recipe_id])
+        return
+    if origin.__dict__.get("_shopping_list_updated"):
+        return
+    origin._shopping_list_updated = True
+    recipe_ids = defaultdict(list)
+    for user_id, recipe_id in origin.values_list("user_id", "recipe_id"):
+        recipe_ids[user_id].append(recipe_id)
+    for user_id, ids in recipe_ids.items():
+        ShoppingListItem.remove_recipes(user_id, ids)
+
+
+def remember_recipe_amounts(sender, instance, origin=None, **kwargs):
+    if origin is None or isinstance(origin, RecipeIngredient):
+        instance._stored_amounts = ShoppingListItem.get_amounts(
+            instance.recipe_id,
+        )
+
+
+def change_recipe_amounts(sender, instance, **kwargs):
+    """Учитывает ингредиент рецепта, изменённый по одной строке.
+
+    Так сохраняет инлайн админки. ``set_ingredients`` пишет строки
+    массово без сигналов и обновляет списки покупок сам, а каскадное
+    удаление рецепта учтено выше.
+    """
+    stored = instance.__dict__.pop("_stored_amounts", None)
+    if stored is not None:
+        ShoppingListItem.change_recipe(
+            instance.recipe_id,
+            stored,
+            ShoppingListItem.get_amounts(instance.recipe_id),
+        )
+
+
+pre_save.connect(remember_recipe_amounts, sender=RecipeIngredient)
+pre_delete.connect(remember_recipe_amounts, sender=RecipeIngredient)
+post_save.connect(change_recipe_amounts, sender=RecipeIngredient)
+post_delete.connect(change_recipe_amounts, sender=RecipeIngredient)
+
+
+def get_loaded_image(instance, field):
+    """Имя файла изображения, если поле загружено из базы."""
+    value = instance.__dict__.get(field)
+    return getattr(value, "name", value)
+
+
+def remember_image(sender, instance, **kwargs):
+    field, _ = IMAGE_FIELDS[sender]
+    if field in instance.__dict__:
+        instance._loaded_image = get_loaded_image(instance, field)
+
+
+def track_image_change(sender, instance, raw=False, **kwargs):
+    """Запоминает смену изображения и сбрасывает его копии.
+
+    Пустые копии - признак для ``make_image_variants`` создать их
+    заново; до этого клиенты получают только оригинал.
+    """
+    field, variants_field = IMAGE_FIELDS[sender]
+    if raw or not hasattr(instance, "_loaded_image"):
+        return
+    old = None if instance._state.adding else instance._loaded_image
+    name = get_loaded_image(instance, field)
+    if name != old:
+        setattr(instance, variants_field, {})
+        instance._replaced_image = old
+        instance._assigned_image = name
+
+
+def count_image_references(sender, instance, **kwargs):
+    """Переносит ссылку со старого файла изображения на новый.
+
+    На загруженный файл ссылку уже взяло хранилище, сохраняя его под
+    именем по содержимому. Ссылку берём здесь, только если полю
+    присвоили имя уже сохранённого файла.
+    """
+    if "_replaced_image" not in instance.__dict__:
+        return
+    field, _ = IMAGE_FIELDS[sender]
+    old = instance.__dict__.pop("_replaced_image")
+    assigned = instance.__dict__.pop("_assigned_image")
+    name = get_loaded_image(instance, field)
+    instance._loaded_image = name
+    if name == assigned:
+        MediaFile.acquire(name)
+    MediaFile.release(old)
+
+
+def release_image(sender, instance, **kwargs):
+    field, _ = IMAGE_FIELDS[sender]
+    MediaFile.release(get_loaded_image(instance, field))
+
+
+for model in IMAGE_FIELDS:
+    post_init.connect(remember_image, sender=model)
+    pre_save.connect(track_image_change, sender=model)
+    post_save.connect(count_image_references, sender=model)
+    post_delete.connect(release_image, sender=model)
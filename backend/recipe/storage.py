@@ -0,0 +1,71 @@
+import hashlib
+import posixpath
+
+from django.apps import apps
+from django.core.files.storage import FileSystemStorage
+from django.db.models import Q
+from django.utils.deconstruct import deconstructible
+
+# Каталог файлов с именами по содержимому внутри MEDIA_ROOT
+CONTENT_PREFIX = "images/content"
+
+
+def is_content_addressed(name):
+    return bool(name) and name.startswith(f"{CONTENT_PREFIX}/")
+
+
+def variants_pending(field, variants_field):
+    """Условие «у изображения ещё нет уменьшенных копий».
+
+    Одно и то же выражение задаёт частичный индекс и выборку
+    ``make_image_variants``, поэтому PostgreSQL использует индекс, а не
+    просматривает всю таблицу.
+    """
+    return Q(**{variants_field: {}}) & ~Q(**{field: ""})
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, называющее файлы по SHA-256 содержимого.
+
+    Одинаковые байты попадают в один файл, повторная запись
+    пропускается. Число ссылок на файл хранит ``MediaFile``, поэтому
+    ``delete`` удаляет файл, только когда на него никто не ссылается.
+    Ссылку на сохраняемый файл хранилище берёт до проверки его наличия:
+    одновременное удаление того же файла без ссылок либо дождётся её и
+    не удалит файл, либо завершится раньше, и файл будет записан заново.
+    Модель ищется лениво, чтобы хранилище можно было подключать к полям
+    моделей любого приложения.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("allow_overwrite", True)
+        super().__init__(*args, **kwargs)
+
+    def get_content_name(self, name, content):
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        digest = digest.hexdigest()
+        extension = posixpath.splitext(name)[1].lower()
+        return posixpath.join(
+            CONTENT_PREFIX, digest[:2], digest[2:4], digest + extension,
+        )
+
+    def _save(self, name, content):
+        name = self.get_content_name(name, content)
+        apps.get_model("recipe", "MediaFile").acquire(name)
+        if self.exists(name):
+            return name
+        return super()._save(name, content)
+
+    def delete(self, name):
+        MediaFile = apps.get_model("recipe", "MediaFile")
+        if MediaFile.objects.filter(name=name, refcount__gt=0).exists():
+            return
+        super().delete(name)
+
+
+content_storage = ContentAddressedStorage()
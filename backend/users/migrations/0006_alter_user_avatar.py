@@ -0,0 +1,20 @@
+# Generated by Django 5.2.6 on 2026-10-18 17:41
+
+import recipe.storage
+import users.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_user_avatar_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='avatar',
+            field=models.ImageField(blank=True, storage=recipe.storage.ContentAddressedStorage(), upload_to=users.models.user_avatar_path, verbose_name='Аватар'),
+        ),
+    ]
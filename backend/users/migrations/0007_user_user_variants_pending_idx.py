@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 18:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('users', '0006_alter_user_avatar'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(condition=models.Q(('avatar_variants', {}), models.Q(('avatar', ''), _negated=True)), fields=['id'], name='user_variants_pending_idx'),
+        ),
+    ]
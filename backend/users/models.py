@@ -1,8 +1,11 @@
+import copy
+
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 
 from app import constants
+from recipe.storage import content_storage, variants_pending
 
 
 def user_avatar_path(instance, filename):
@@ -38,9 +41,16 @@ class User(AbstractUser):
     )
     avatar = models.ImageField(
         upload_to=user_avatar_path,
+        storage=content_storage,
         blank=True,
         verbose_name="Аватар",
     )
+    avatar_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name="Уменьшенные копии аватара",
+    )
 
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = [
@@ -53,10 +63,49 @@ class User(AbstractUser):
     class Meta:
         verbose_name = "Пользователь"
         verbose_name_plural = "Пользователи"
+        indexes = [
+            models.Index(
+                fields=["id"],
+                condition=variants_pending("avatar", "avatar_variants"),
+                name="user_variants_pending_idx",
+            ),
+        ]
 
     def __str__(self):
         return self.email
 
+    def save(self, *args, **kwargs):
+        tracked = self.__dict__.get("_tracked_values")
+        if (
+            tracked is not None
+            and kwargs.get("update_fields") is None
+            and not self._state.adding
+        ):
+            kwargs["update_fields"] = [
+                name for name, value in self.get_field_values().items()
+                if tracked[name] != value
+            ]
+        super().save(*args, **kwargs)
+        if tracked is not None:
+            self.track_changes()
+
+    def get_field_values(self):
+        """Значения полей в виде для базы, без общих изменяемых объектов."""
+        return {
+            field.attname: copy.deepcopy(
+                field.get_prep_value(field.value_from_object(self)),
+            )
+            for field in self._meta.concrete_fields
+        }
+
+    def track_changes(self):
+        """Дальше ``save()`` без ``update_fields`` пишет только изменения.
+
+        Так сохраняется пользователь из кеша токенов: остальные его поля
+        могли устареть, и полное сохранение записало бы их поверх новых.
+        """
+        self._tracked_values = self.get_field_values()
+
 
 class Subscribtion(models.Model):
     user = models.ForeignKey(